@@ -18,8 +18,25 @@ from .metadata import (
 )
 
 from .harvest import *
+from .breaker import CircuitBreaker, CircuitOpenError, status_probe
+from .diffing import WriteDiffer
+from .transport import Transport, RecordingTransport, ReplayTransport
+from .ratelimit import TokenBucket
+from .pool import HarvestPool
+from .scheduler import RequestScheduler
+from .snapshot import Snapshot, publish_snapshot, write_snapshot
+from .writebehind import WriteBehindQueue
+from .watch import DailyWatcher, WatchEvent
+from .lineitems import LineItems, extract_line_items
+from .streaming import iter_json_array
+from .merge import ExternalSorter, merge_timesheets
+from .rollups import Rollups, Totals
 
 __all__ = [
     '__author__', '__copyright__', '__email__', '__license__',
-    '__maintainer__', '__version__', 'harvest'
+    '__maintainer__', '__version__', 'harvest', 'breaker',
+    'diffing', 'transport', 'ratelimit', 'pool',
+    'scheduler', 'snapshot', 'writebehind',
+    'watch', 'lineitems', 'streaming',
+    'merge', 'rollups',
 ]
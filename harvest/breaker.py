@@ -0,0 +1,205 @@
+"""
+ breaker.py
+
+ Circuit breaker guarding the requests made by a Harvest client.
+
+ The breaker watches the outcome and latency of every request.  When the
+ failure rate over a rolling window gets too high it opens and every call
+ fails fast with CircuitOpenError until a cool-down has elapsed.  After that
+ a limited number of trial requests are let through (half-open); if they
+ succeed the breaker closes again, otherwise it re-opens.
+"""
+from __future__ import print_function
+
+import time
+import threading
+from collections import deque
+
+from .harvest import HarvestError, status
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Seconds the status page may take to answer a probe
+PROBE_TIMEOUT = 2.0
+
+
+class CircuitOpenError(HarvestError):
+    """ Raised instead of sending a request while the circuit is open """
+    def __init__(self, retry_after):
+        super(CircuitOpenError, self).__init__(
+            'Harvest circuit is open, retry in {0:.1f}s'.format(retry_after))
+        self.retry_after = retry_after
+
+
+def status_probe():
+    """
+    Probe built on the harveststatus.com endpoint.
+    Returns False only when Harvest itself reports a major outage, so an
+    unreachable status page does not keep the circuit open.
+    """
+    return status(timeout=PROBE_TIMEOUT).get('indicator') not in ('major', 'critical')
+
+
+class CircuitBreaker(object):
+    """
+    Closed/open/half-open circuit breaker.
+
+    - window: number of recent calls used to compute the failure rate
+    - min_calls: calls needed in the window before the breaker may trip
+    - failure_rate: fraction of failed calls that opens the circuit
+    - slow_call: seconds after which a successful call counts as failed
+    - reset_timeout: seconds to stay open before allowing trial calls
+    - half_open_calls: concurrent trial calls allowed while half-open
+    - probe: optional callable checked before going half-open, e.g. status_probe;
+      it runs without the lock held, other callers see the circuit open meanwhile
+    - on_state_change: optional callable(old_state, new_state)
+    """
+    def __init__(self, window=50, min_calls=10, failure_rate=0.5,
+                 slow_call=None, reset_timeout=30.0, half_open_calls=1,
+                 probe=None, on_state_change=None, clock=time.time):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.probe = probe
+        self.on_state_change = on_state_change
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = None
+        self._trials = 0
+        self._probing = False
+
+    @property
+    def state(self):
+        """ current state, moving from open to half-open once the cool-down is over """
+        self._run_probe()
+        with self._lock:
+            return self._current_state()
+
+    @property
+    def is_open(self):
+        """ True while calls would be rejected """
+        return self.state == OPEN
+
+    def retry_after(self):
+        """ Seconds until the breaker lets a trial call through (0 if not open) """
+        self._run_probe()
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def stats(self):
+        """ Snapshot of the breaker state and rolling window """
+        self._run_probe()
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(self._outcomes)
+            return {
+                'state': self._current_state(),
+                'calls': calls,
+                'failures': failures,
+                'failure_rate': float(failures) / calls if calls else 0.0,
+            }
+
+    def allow(self):
+        """
+        Called before each request; raises CircuitOpenError when the call
+        must not be sent.
+        """
+        self._run_probe()
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN:
+                raise CircuitOpenError(
+                    max(0.0, self._opened_at + self.reset_timeout - self._clock()))
+            if state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    raise CircuitOpenError(0.0)
+                self._trials += 1
+
+    def record(self, elapsed, failed=False):
+        """
+        Called after each request with its latency in seconds and whether
+        it failed (exception or server error).
+        """
+        if self.slow_call is not None and elapsed >= self.slow_call:
+            failed = True
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trials = max(0, self._trials - 1)
+                if failed:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._transition(CLOSED)
+                return
+            if self._state == OPEN:
+                return
+            self._outcomes.append(1 if failed else 0)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and \
+                    float(sum(self._outcomes)) / calls >= self.failure_rate:
+                self._open()
+
+    def reset(self):
+        """ Force the breaker closed and forget past outcomes """
+        with self._lock:
+            self._outcomes.clear()
+            self._trials = 0
+            self._transition(CLOSED)
+
+    # Internal methods
+
+    def _run_probe(self):
+        """ Run a due probe without the lock, so a slow status page blocks no caller """
+        if self.probe is None:
+            return
+        with self._lock:
+            if self._probing or not self._cooled_down():
+                return
+            self._probing = True
+        healthy = True
+        try:
+            healthy = self.probe()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._probing = False
+                if self._cooled_down():
+                    if healthy:
+                        self._half_open()
+                    else:
+                        self._opened_at = self._clock()
+
+    # Internal methods (call with the lock held)
+
+    def _cooled_down(self):
+        return self._state == OPEN and \
+            self._clock() - self._opened_at >= self.reset_timeout
+
+    def _current_state(self):
+        # With a probe, only _run_probe() leaves the open state
+        if self.probe is None and self._cooled_down():
+            self._half_open()
+        return self._state
+
+    def _half_open(self):
+        self._trials = 0
+        self._transition(HALF_OPEN)
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._transition(OPEN)
+
+    def _transition(self, new_state):
+        old_state, self._state = self._state, new_state
+        if old_state != new_state and self.on_state_change is not None:
+            self.on_state_change(old_state, new_state)
@@ -0,0 +1,177 @@
+"""
+ diffing.py
+
+ Field-level diffing of update_* payloads against the last known server state.
+
+ A WriteDiffer keeps the last record seen for every updated resource path.
+ Before a PUT the outgoing payload is compared to that record: unchanged
+ writes are skipped altogether and, where the endpoint accepts partial
+ updates, only the changed fields are sent.
+
+ The saving comes from records the differ already holds: prime() them from
+ list responses fetched anyway.  With fetch=True an uncached record costs a
+ GET before its PUT, which only pays off when the same resource is updated
+ again.  Changes made elsewhere (the web UI, other processes) are not seen:
+ set `max_age` to refetch records cached for too long, or forget() a path
+ known to have changed.
+"""
+from __future__ import print_function
+
+import copy
+import time
+import threading
+
+# Payload roots whose endpoints accept a subset of fields on PUT
+DEFAULT_PARTIAL_ROOTS = ('project', 'client', 'contact', 'task', 'invoice')
+
+
+def _root(payload):
+    """ Return the single wrapping key of a Harvest payload, or None """
+    if isinstance(payload, dict) and len(payload) == 1:
+        key = list(payload)[0]
+        if isinstance(payload[key], dict):
+            return key
+    return None
+
+
+def _text(value):
+    """ Unicode form of a scalar; byte strings are taken as UTF-8 """
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return u'{0}'.format(value)
+
+
+def _same(known, value):
+    """ Loose equality: the API returns numbers where callers often send strings """
+    if known is None or value is None or isinstance(known, (dict, list)):
+        return known == value
+    # unicode never equals non-ASCII bytes in Python 2, so compare both as text
+    if not isinstance(known, bytes) and not isinstance(value, bytes) and known == value:
+        return True
+    return _text(known) == _text(value)
+
+
+def diff_payload(known, payload):
+    """
+    Compare an outgoing payload to a known record of the same shape.
+    Returns None when they cannot be compared, otherwise a payload holding
+    only the changed fields (empty dict when nothing changed).
+    """
+    root = _root(payload)
+    if root is None or _root(known) != root:
+        return None
+    current = known[root]
+    changed = dict(
+        (field, value)
+        for field, value in payload[root].items()
+        if field not in current or not _same(current[field], value)
+    )
+    return {root: changed} if changed else {}
+
+
+class WriteDiffer(object):
+    """
+    Optional diffing layer for the client's update_* calls.
+
+    - fetch: GET the resource when its state is not cached (or is stale)
+    - partial: payload roots whose endpoints accept only the changed fields
+    - max_age: seconds a cached record is trusted; None trusts it until forgotten
+    """
+    def __init__(self, fetch=True, partial=DEFAULT_PARTIAL_ROOTS, max_age=None, clock=time.time):
+        self.fetch = fetch
+        self.partial = frozenset(partial)
+        self.max_age = max_age
+        self._clock = clock
+        self._known = {}
+        self._seen = {}             # path -> time its record was fetched or primed
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.skipped = 0
+        self.fetched = 0
+        self.fields_sent = 0
+
+    def remember(self, path, record):
+        """ Record the server state of the resource at `path` """
+        if _root(record) is None:
+            return
+        with self._lock:
+            self._known[path] = copy.deepcopy(record)
+            self._seen[path] = self._clock()
+
+    def prime(self, path_format, records):
+        """
+        Remember every record of a list response, e.g.
+        differ.prime('/projects/{0}', client.projects())
+        """
+        for record in records:
+            root = _root(record)
+            if root is not None and 'id' in record[root]:
+                self.remember(path_format.format(record[root]['id']), record)
+
+    def forget(self, path=None):
+        """ Drop the cached state of one path, or of everything """
+        with self._lock:
+            if path is None:
+                self._known.clear()
+                self._seen.clear()
+            else:
+                self._known.pop(path, None)
+                self._seen.pop(path, None)
+
+    def stats(self):
+        """ Counters of skipped and sent writes """
+        return {
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'fetched': self.fetched,
+            'fields_sent': self.fields_sent,
+        }
+
+    def put(self, client, path, data):
+        """
+        PUT `data` to `path` through `client` unless it matches the known state.
+        A skipped write returns the cached record instead of a response.
+        The cache only follows writes the server accepted (2xx).
+        """
+        with self._lock:
+            known = None
+            if path in self._known and not self._stale(path):
+                known = copy.deepcopy(self._known[path])
+        if known is None and self.fetch:
+            known = client._get(path)
+            with self._lock:
+                self.fetched += 1
+            self.remember(path, known)
+
+        changes = diff_payload(known, data)
+        if changes == {}:
+            with self._lock:
+                self.skipped += 1
+            return known
+
+        root = _root(data)
+        body = data
+        if changes is not None and root in self.partial:
+            body = changes
+        resp = client._put(path, data=body, raw=True)
+
+        with self._lock:
+            self.sent += 1
+            self.fields_sent += len(body[root]) if root else 1
+        if 200 <= resp.status_code < 300 and root is not None:
+            with self._lock:
+                if _root(self._known.get(path)) == root and not self._stale(path):
+                    # The fields not written are as old as the cached record
+                    self._known[path][root].update(copy.deepcopy(body[root]))
+                else:
+                    self._known[path] = copy.deepcopy(data)
+                    self._seen[path] = self._clock()
+        else:
+            self.forget(path)
+        return client._decode('PUT', resp)
+
+    # Internal methods
+
+    def _stale(self, path):
+        """ Whether the cached record of `path` is too old to trust (call with the lock held) """
+        return self.max_age is not None and self._clock() - self._seen[path] > self.max_age
@@ -9,6 +9,9 @@ from __future__ import print_function
 
 import sys
 import json
+import time
+import threading
+from contextlib import contextmanager
 from urlparse import urlparse
 from base64 import b64encode as enc64
 from itertools import count
@@ -16,8 +19,21 @@ from itertools import count
 import requests
 from requests_oauthlib import OAuth2Session
 
+from .transport import Transport
+from .watch import DailyWatcher
+from .lineitems import extract_line_items
+from .streaming import iter_json_array
+
 HARVEST_STATUS_URL = 'http://www.harveststatus.com/api/v2/status.json'
 
+# Bytes read from the socket at a time by streamed responses
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Request priority classes, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+
 # pylint: disable=too-many-arguments
 # pylint: disable=bare-except
 # pylint: disable=too-many-public-methods
@@ -31,31 +47,59 @@ class HarvestError(Exception):
 class Harvest(object):
     """
     Harvest class to implement Harvest API
+
+    An instance may be shared between threads: its configuration is fixed
+    at construction, and each thread sends its requests through its own
+    session (sharing the connection pool of `adapter` when one is given).
     """
     def __init__(self, uri, email=None, password=None, client_id=None,
-                 token=None, put_auth_in_header=True):
-        """ Init method """
+                 token=None, put_auth_in_header=True, breaker=None, differ=None,
+                 transport=None, adapter=None, limiter=None, scheduler=None):
+        """
+        Init method
+        breaker: optional CircuitBreaker consulted around every request
+        differ: optional WriteDiffer used by the update_* methods
+        transport: optional Transport sending the requests (e.g. record/replay)
+        adapter: optional requests HTTPAdapter, to share connection pools between clients
+        limiter: optional object whose acquire() is called before every request;
+            with a scheduler, its try_acquire() and delay() are used when present
+        scheduler: optional RequestScheduler ordering requests by priority class
+        """
         self.__uri = uri.rstrip('/')
         parsed = urlparse(uri)
         if not (parsed.scheme and parsed.netloc):
             raise HarvestError('Invalid harvest uri "{0}".'.format(uri))
 
-        self.__headers = {
+        headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json',
             'User-Agent': 'Mozilla/5.0',  # 'TimeTracker for Linux' -- ++ << >>
         }
+        self.__request_auth = None
         if email and password:
             self.__auth = 'Basic'
             self.__email = email.strip()
             self.__password = password
             if put_auth_in_header:
                 basic_auth = enc64('{self.email}:{self.password}'.format(self=self))
-                self.__headers['Authorization'] = 'Basic {0}'.format(basic_auth)
+                headers['Authorization'] = 'Basic {0}'.format(basic_auth)
+            else:
+                self.__request_auth = (self.__email, self.__password)
         elif client_id and token:
             self.__auth = 'OAuth2'
             self.__client_id = client_id
-            self.__token = token
+            self.__token = dict(token)
+        # Request defaults are immutable, so threads can read them without locking
+        self.__headers = tuple(headers.items())
+        self.__breaker = breaker
+        self.__differ = differ
+        self.__transport = transport or Transport()
+        self.__adapter = adapter
+        self.__limiter = limiter
+        self.__scheduler = scheduler
+        self.__local = threading.local()
+        self.__watcher = None
+        self.__watcher_lock = threading.Lock()
 
     @property
     def uri(self):
@@ -85,7 +129,52 @@ class Harvest(object):
     @property
     def token(self):
         """ token property """
-        return self.__token
+        return dict(self.__token)
+
+    @property
+    def headers(self):
+        """ default request headers property """
+        return dict(self.__headers)
+
+    @property
+    def breaker(self):
+        """ circuit breaker property (None when disabled) """
+        return self.__breaker
+
+    @property
+    def differ(self):
+        """ write differ property (None when disabled) """
+        return self.__differ
+
+    @property
+    def transport(self):
+        """ transport property """
+        return self.__transport
+
+    @property
+    def limiter(self):
+        """ rate limiter property (None when disabled) """
+        return self.__limiter
+
+    @property
+    def scheduler(self):
+        """ request scheduler property (None when disabled) """
+        return self.__scheduler
+
+    @contextmanager
+    def priority(self, priority):
+        """
+        Run the calls made in this thread within the block at `priority`
+        (PRIORITY_INTERACTIVE, PRIORITY_NORMAL or PRIORITY_BATCH) instead of
+        each method's own class, e.g.
+        with client.priority(PRIORITY_BATCH): client.get_day(day, year)
+        """
+        previous = getattr(self.__local, 'priority', None)
+        self.__local.priority = priority
+        try:
+            yield
+        finally:
+            self.__local.priority = previous
 
     @property
     def status(self):
@@ -104,7 +193,7 @@ class Harvest(object):
 
     # Client Contacts
 
-    def contacts(self, updated_since=None):
+    def contacts(self, updated_since=None, stream=False):
         """
         Get list of all contacts (optionally since a given date)
         http://help.getharvest.com/api/clients-api/clients/using-the-client-contacts-api/
@@ -112,7 +201,7 @@ class Harvest(object):
         url = '/contacts'
         if updated_since is not None:
             url = '{0}?updated_since={1}'.format(url, updated_since)
-        return self._get(url)
+        return self._get(url, stream=stream)
 
     def get_contact(self, contact_id):
         """
@@ -131,7 +220,7 @@ class Harvest(object):
         kwargs.update({'first-name': fname, 'last-name': lname})
         return self._post(url, data=kwargs)
 
-    def client_contacts(self, client_id, updated_since=None):
+    def client_contacts(self, client_id, updated_since=None, stream=False):
         """
         Get all contacts for a client by client_id (optionally specifing anupdated_since data)
         http://help.getharvest.com/api/clients-api/clients/using-the-client-contacts-api/#get-all-contacts-for-a-client
@@ -139,7 +228,7 @@ class Harvest(object):
         url = '/clients/{0}/contacts'.format(client_id)
         if updated_since is not None:
             url = '{0}?updated_since={1}'.format(url, updated_since)
-        return self._get(url)
+        return self._get(url, stream=stream)
 
     def update_contact(self, contact_id, **kwargs):
         """
@@ -147,7 +236,7 @@ class Harvest(object):
         http://help.getharvest.com/api/clients-api/clients/using-the-client-contacts-api/#update-a-client-contact
         """
         url = '/contacts/{0}'.format(contact_id)
-        return self._put(url, data=kwargs)
+        return self._update(url, data=kwargs)
 
     def delete_contact(self, contact_id):
         """
@@ -159,7 +248,7 @@ class Harvest(object):
 
     # Clients
 
-    def clients(self, updated_since=None):
+    def clients(self, updated_since=None, stream=False):
         """
         Get clients (optionally update since a date)
         http://help.getharvest.com/api/clients-api/clients/using-the-clients-api/#get-all-clients
@@ -167,7 +256,7 @@ class Harvest(object):
         url = '/clients'
         if updated_since is not None:
             url = '{0}?updated_since={1}'.format(url, updated_since)
-        return self._get(url)
+        return self._get(url, stream=stream)
 
     def get_client(self, client_id):
         """
@@ -191,7 +280,7 @@ class Harvest(object):
         http://help.getharvest.com/api/clients-api/clients/using-the-clients-api/#update-a-client
         """
         url = '/clients/{0}'.format(client_id)
-        return self._put(url, data=kwargs)
+        return self._update(url, data=kwargs)
 
     def toggle_client_active(self, client_id):
         """
@@ -211,13 +300,13 @@ class Harvest(object):
 
     # People
 
-    def people(self):
+    def people(self, stream=False):
         """
         Get all the people
         http://help.getharvest.com/api/users-api/users/managing-users/
         """
         url = '/people'
-        return self._get(url)
+        return self._get(url, stream=stream)
 
     def get_person(self, person_id):
         """
@@ -244,7 +333,7 @@ class Harvest(object):
 
     # Projects
 
-    def projects(self, client=None):
+    def projects(self, client=None, stream=False):
         """
         Get all the projects (optinally restricted to a particular client)
         """
@@ -253,29 +342,33 @@ class Harvest(object):
             # For example to show only the projects belonging to client with the id 23445.
             # GET /projects?client=23445
             url = '/projects?client={0}'.format(client)
-            return self._get(url)
-        return self._get('/projects')
+            return self._get(url, stream=stream)
+        return self._get('/projects', stream=stream)
 
-    def projects_for_client(self, client_id):
+    def projects_for_client(self, client_id, stream=False):
         """
         Get the projects for a particular client
         """
         url = '/projects?client={}'.format(client_id)
-        return self._get(url)
+        return self._get(url, stream=stream)
 
-    def timesheets_for_project(self, project_id, start_date, end_date):
+    def timesheets_for_project(self, project_id, start_date, end_date, updated_since=None, stream=False):
         """
         Get the timesheets for a project
         """
         url = '/projects/{0}/entries?from={1}&to={2}'.format(project_id, start_date, end_date)
-        return self._get(url)
+        if updated_since is not None:
+            url = '{0}&updated_since={1}'.format(url, updated_since)
+        return self._get(url, priority=PRIORITY_BATCH, stream=stream)
 
-    def expenses_for_project(self, project_id, start_date, end_date):
+    def expenses_for_project(self, project_id, start_date, end_date, updated_since=None, stream=False):
         """
         Get the expenses for a project between a start date and end date
         """
         url = '/projects/{0}/expenses?from={1}&to={2}'.format(project_id, start_date, end_date)
-        return self._get(url)
+        if updated_since is not None:
+            url = '{0}&updated_since={1}'.format(url, updated_since)
+        return self._get(url, priority=PRIORITY_BATCH, stream=stream)
 
     def get_project(self, project_id):
         """
@@ -296,7 +389,7 @@ class Harvest(object):
         Update a project
         """
         url = '/projects/{0}'.format(project_id)
-        return self._put(url, data=kwargs)
+        return self._update(url, data=kwargs)
 
     def toggle_project_active(self, project_id):
         """
@@ -313,15 +406,15 @@ class Harvest(object):
 
     # Tasks
 
-    def tasks(self, updated_since=None):
+    def tasks(self, updated_since=None, stream=False):
         """
         Get all teh tasks (optionally updated since a particular date)
         /tasks?updated_since=2010-09-25+18%3A30
         """
         if updated_since:
             url = '/tasks?updated_since={0}'.format(updated_since)
-            return self._get(url)
-        return self._get('/tasks')
+            return self._get(url, stream=stream)
+        return self._get('/tasks', stream=stream)
 
     def get_task(self, task_id):
         """
@@ -343,7 +436,7 @@ class Harvest(object):
         Example: client.update_task(task_id, task={"name": "jo"})
         """
         url = '/tasks/{0}'.format(tasks_id)
-        return self._put(url, data=kwargs)
+        return self._update(url, data=kwargs)
 
     def delete_task(self, tasks_id):
         """
@@ -363,13 +456,13 @@ class Harvest(object):
 
     # Task Assignment: Assigning tasks to projects
 
-    def get_all_tasks_from_project(self, project_id):
+    def get_all_tasks_from_project(self, project_id, stream=False):
         """
         GET ALL TASKS ASSIGNED TO A GIVEN PROJECT
         /projects/#{project_id}/task_assignments
         """
         url = '/projects/{0}/task_assignments'.format(project_id)
-        return self._get(url)
+        return self._get(url, stream=stream)
 
     def get_one_task_assigment(self, project_id, task_id):
         """
@@ -470,55 +563,67 @@ class Harvest(object):
     @property
     def today(self):
         """ today property """
-        return self._get('/daily')
+        return self._get('/daily', priority=PRIORITY_INTERACTIVE)
+
+    def watch_daily(self, callback=None, **kwargs):
+        """
+        Subscribe to added/changed/removed entries of today, instead of polling `today`.
+        All subscriptions of a client share one adaptive poller; kwargs
+        (min_interval, max_interval, backoff) configure it when it is created.
+        Example: for event in client.watch_daily(): print(event.kind, event.entry['id'])
+        """
+        with self.__watcher_lock:
+            if self.__watcher is None:
+                self.__watcher = DailyWatcher(self, **kwargs)
+        return self.__watcher.subscribe(callback)
 
     def get_day(self, day_of_the_year=1, year=2012):
         """
         Get time tracking for a day of a particular year
         """
         url = '/daily/{0}/{1}'.format(day_of_the_year, year)
-        return self._get(url)
+        return self._get(url, priority=PRIORITY_INTERACTIVE)
 
     def get_entry(self, entry_id):
         """
         Get a time entry by entry_id
         """
         url = '/daily/show/{0}'.format(entry_id)
-        return self._get(url)
+        return self._get(url, priority=PRIORITY_INTERACTIVE)
 
     def toggle_timer(self, entry_id):
         """
         Toggle the timer for an entry
         """
         url = '/daily/timer/{0}'.format(entry_id)
-        return self._get(url)
+        return self._get(url, priority=PRIORITY_INTERACTIVE)
 
     def add(self, data):
         """
         Create a new time entry?
         """
-        return self._post('/daily/add', data)
+        return self._post('/daily/add', data, priority=PRIORITY_INTERACTIVE)
 
     def add_for_user(self, user_id, data):
         """
         Add data for a user
         """
         url = '/daily/add?of_user={0}'.format(user_id)
-        return self._post(url, data)
+        return self._post(url, data, priority=PRIORITY_INTERACTIVE)
 
     def delete(self, entry_id):
         """
         Delete an entry
         """
         url = '/daily/delete/{0}'.format(entry_id)
-        return self._delete(url)
+        return self._delete(url, priority=PRIORITY_INTERACTIVE)
 
     def update(self, entry_id, data):
         """
         Update an entry
         """
         url = '/daily/update/{0}'.format(entry_id)
-        return self._post(url, data)
+        return self._post(url, data, priority=PRIORITY_INTERACTIVE)
 
     # Invoices
 
@@ -529,10 +634,12 @@ class Harvest(object):
         - client_id
         - status
         - updated since date
+        With stream=True the invoices are yielded page after page as they are parsed.
         http://help.getharvest.com/api/invoices-api/invoices/show-invoices/#show-recently-created-invoices
         """
         # If you do not specify a list of pages to retrieve, it gets all pages.
         pages = kwargs.pop("pages", count(start=1))
+        stream = kwargs.pop("stream", False)
 
         formats = {
             'start_date': 'from={0}',
@@ -546,15 +653,31 @@ class Harvest(object):
             if value
         )
 
+        urls = (
+            '/invoices?page={0}{1}'.format(page, formatted_args and ("&" + formatted_args))
+            for page in pages
+        )
+        if stream:
+            return self._iter_pages(urls)
+
         invoices = []
-        for page in pages:
-            url = '/invoices?page={0}{1}'.format(page, formatted_args and ("&" + formatted_args))
-            invoice_set = self._get(url)
+        for url in urls:
+            invoice_set = self._get(url, priority=PRIORITY_BATCH)
             if not invoice_set:
                 break
             invoices += invoice_set
         return invoices
 
+    def invoice_line_items(self, invoices=None, **kwargs):
+        """
+        Line items of many invoices parsed in one pass into columns (LineItems).
+        Parses `invoices` when given, otherwise invoices(**kwargs).
+        Example: client.invoice_line_items(status_enum='paid').totals_by('kind')
+        """
+        if invoices is None:
+            invoices = self.invoices(stream=True, **kwargs)
+        return extract_line_items(invoices)
+
     def get_invoice(self, invoice_id):
         """
         Get an invoice by `invoice_id`
@@ -577,7 +700,7 @@ class Harvest(object):
         http://help.getharvest.com/api/invoices-api/invoices/show-invoices/#update-existing-invoice
         """
         url = '/invoices/{0}'.format(invoice_id)
-        return self._put(url, data)
+        return self._update(url, data)
 
     def add_invoice(self, data):
         """
@@ -587,64 +710,200 @@ class Harvest(object):
         return self._post('/invoices', data)
 
     # Internal methods
-    def _get(self, path='/', data=None):
+    def _get(self, path='/', data=None, priority=None, stream=False):
         """
         Internal method to GET from a url
         """
-        return self._request('GET', path, data)
+        return self._request('GET', path, data, priority, stream)
+
+    def _iter_pages(self, urls):
+        """
+        Internal method to stream the records of successive pages until an empty one
+        """
+        for url in urls:
+            empty = True
+            for record in self._get(url, priority=PRIORITY_BATCH, stream=True):
+                empty = False
+                yield record
+            if empty:
+                break
 
-    def _post(self, path='/', data=None):
+    def _post(self, path='/', data=None, priority=None):
         """
         Internal method to POST to a url
         """
-        return self._request('POST', path, data)
+        return self._request('POST', path, data, priority)
 
-    def _put(self, path='/', data=None):
+    def _put(self, path='/', data=None, priority=None, raw=False):
         """
         Internal method to PUT to a url
         """
-        return self._request('PUT', path, data)
+        return self._request('PUT', path, data, priority, raw=raw)
+
+    def _update(self, path='/', data=None):
+        """
+        Internal method to PUT an update, skipping unchanged fields when a
+        differ is configured
+        """
+        if self.__differ is not None:
+            return self.__differ.put(self, path, data)
+        return self._put(path, data)
 
-    def _delete(self, path='/', data=None):
+    def _delete(self, path='/', data=None, priority=None):
         """
         Internal method to DELETE a url
         """
-        return self._request('DELETE', path, data)
+        return self._request('DELETE', path, data, priority)
 
-    def _request(self, method='GET', path='/', data=None):
+    def _session(self):
         """
-        Internal method to use requests library
+        Internal method returning the calling thread's session, created on
+        first use and routed through the shared adapter when there is one
         """
+        session = getattr(self.__local, 'session', None)
+        if session is None:
+            if self.auth == 'OAuth2':
+                session = OAuth2Session(client_id=self.client_id, token=self.token)
+            else:
+                session = requests.Session()
+            if self.__adapter is not None:
+                session.mount('https://', self.__adapter)
+                session.mount('http://', self.__adapter)
+            self.__local.session = session
+        return session
+
+    def _request(self, method='GET', path='/', data=None, priority=None, stream=False, raw=False):
+        """
+        Internal method to use requests library
+        With stream=True the response is parsed incrementally and an iterator
+        over the records of the top-level JSON array is returned.
+        With raw=True the response itself is returned, see _decode.
+        """
+        if getattr(self.__local, 'priority', None) is not None:
+            priority = self.__local.priority
+        elif priority is None:
+            priority = PRIORITY_NORMAL
         kwargs = {
             'method': method,
             'url': '{self.uri}{path}'.format(self=self, path=path),
-            'headers': self.__headers,
+            'headers': dict(self.__headers),
             'data': json.dumps(data),
         }
-        if self.auth == 'Basic':
-            requestor = requests
-            if 'Authorization' not in self.__headers:
-                kwargs['auth'] = (self.email, self.password)
-        elif self.auth == 'OAuth2':
-            requestor = OAuth2Session(client_id=self.client_id, token=self.token)
+        if stream:
+            kwargs['stream'] = True
+        if self.__request_auth is not None:
+            kwargs['auth'] = self.__request_auth
+        requestor = self._session()
+
+        breaker = self.__breaker
+        if breaker is not None:
+            breaker.allow()
+        scheduler = self.__scheduler
+        if scheduler is not None:
+            # The scheduler draws the rate budget in priority order
+            scheduler.acquire(priority, self.__limiter)
+        elif self.__limiter is not None:
+            self.__limiter.acquire()
+        start = time.time()
+
+        def finish(failed):
+            if scheduler is not None:
+                scheduler.release(priority)
+            if breaker is not None:
+                breaker.record(time.time() - start, failed=failed)
 
         try:
-            resp = requestor.request(**kwargs)
-            if 'DELETE' not in method:
-                try:
-                    return resp.json()
-                except:
-                    return resp
-            return resp
+            resp = self.__transport.send(requestor, **kwargs)
         except Exception as exc:
+            finish(failed=True)
             raise HarvestError(exc)
+        except:
+            finish(failed=True)
+            raise
+
+        if stream:
+            # The slot is held, and the latency measured, until the body is read
+            return _StreamedRecords(resp, finish)
+        finish(failed=resp.status_code >= 500)
+        if raw:
+            return resp
+        return self._decode(method, resp)
+
+    @staticmethod
+    def _decode(method, resp):
+        """
+        Internal method turning a response into the value returned to callers
+        """
+        if 'DELETE' not in method:
+            try:
+                return resp.json()
+            except:
+                return resp
+        return resp
+
+
+class _StreamedRecords(object):
+    """
+    Iterator over the records of a streamed response.  `finish(failed)` runs
+    once the body is consumed, fails, or the iterator is closed or dropped,
+    even before its first record.
+    """
+    def __init__(self, resp, finish):
+        self._done = _StreamDone(resp, finish)
+        self._records = _iter_records(resp, self._done)
+
+    def __iter__(self):
+        return self
 
+    def next(self):
+        return next(self._records)
 
-def status():
+    __next__ = next
+
+    def close(self):
+        self._records.close()
+        self._done()
+
+    def __del__(self):
+        self.close()
+
+
+class _StreamDone(object):
+    """ Closes a streamed response and reports its outcome, once """
+    def __init__(self, resp, finish):
+        self.resp = resp
+        self.finish = finish
+        self.failed = resp.status_code >= 500
+
+    def __call__(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            self.resp.close()
+            finish(self.failed)
+
+
+def _iter_records(resp, done):
+    """
+    Parse a streamed response record by record
+    """
+    try:
+        if not 200 <= resp.status_code < 300:
+            raise HarvestError('HTTP {0}: {1}'.format(resp.status_code, resp.text))
+        for record in iter_json_array(resp.iter_content(STREAM_CHUNK_SIZE)):
+            yield record
+    except ValueError as exc:
+        # A body cut short is a failed call for the breaker too
+        done.failed = True
+        raise HarvestError(exc)
+    finally:
+        done()
+
+
+def status(timeout=None):
     """
     Global scope status funciton
     """
     try:
-        return requests.get(HARVEST_STATUS_URL).json().get('status', {})
+        return requests.get(HARVEST_STATUS_URL, timeout=timeout).json().get('status', {})
     except:
         return {}
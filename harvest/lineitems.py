@@ -0,0 +1,125 @@
+"""
+ lineitems.py
+
+ Batch extraction of invoice line items into a columnar structure.
+
+ Harvest embeds the line items of an invoice as a CSV blob
+ (`csv_line_items`).  extract_line_items() parses the blobs of any number of
+ invoices in a single pass and stores every column in one list or typed
+ array, so roll-ups such as revenue per kind run over flat arrays instead
+ of one dict per line.
+"""
+from __future__ import print_function
+
+from array import array
+from csv import reader
+from collections import defaultdict
+
+NUMERIC_COLUMNS = ('quantity', 'unit_price', 'amount')
+TEXT_COLUMNS = ('kind', 'description')
+
+
+def _floats(values):
+    """ Typed array of floats; blanks and malformed numbers count as 0 """
+    try:
+        return array('d', map(float, values))
+    except ValueError:
+        def number(value):
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+        return array('d', map(number, values))
+
+
+class LineItems(object):
+    """
+    Line items of many invoices, one column per field:
+    invoice_id (array of ints), kind and description (lists of strings),
+    quantity, unit_price and amount (arrays of floats)
+    """
+    columns = ('invoice_id',) + TEXT_COLUMNS + NUMERIC_COLUMNS
+
+    def __init__(self, invoice_id, kind, description, quantity, unit_price, amount):
+        self.invoice_id = invoice_id
+        self.kind = kind
+        self.description = description
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.amount = amount
+
+    def __len__(self):
+        return len(self.invoice_id)
+
+    def total(self, column='amount'):
+        """ Sum of a numeric column """
+        return sum(getattr(self, column))
+
+    def totals_by(self, key='kind', column='amount'):
+        """ Sum of a numeric column grouped by another column, e.g. revenue per kind """
+        totals = defaultdict(float)
+        for group, value in zip(getattr(self, key), getattr(self, column)):
+            totals[group] += value
+        return dict(totals)
+
+    def rows(self):
+        """ Iterate over the line items as tuples in `columns` order """
+        return zip(*[getattr(self, column) for column in self.columns])
+
+    def to_numpy(self):
+        """ Columns as numpy arrays (numeric columns are not copied); needs numpy """
+        import numpy
+        converted = {}
+        for column in self.columns:
+            values = getattr(self, column)
+            if isinstance(values, array):
+                converted[column] = numpy.frombuffer(values, dtype=values.typecode)
+            else:
+                converted[column] = numpy.array(values, dtype=object)
+        return converted
+
+
+def extract_line_items(invoices):
+    """
+    Parse the `csv_line_items` of invoices (as returned by get_invoice or
+    invoices()) into LineItems.  Invoices without line items are skipped.
+    """
+    invoice_ids = array('l')
+    text = dict((column, []) for column in TEXT_COLUMNS)
+    numbers = dict((column, []) for column in NUMERIC_COLUMNS)
+    wanted = TEXT_COLUMNS + NUMERIC_COLUMNS
+    targets = [text.get(column, numbers.get(column)) for column in wanted]
+
+    for invoice in invoices:
+        if isinstance(invoice, dict) and 'invoice' in invoice:
+            invoice = invoice['invoice']
+        blob = invoice.get('csv_line_items')
+        if not blob:
+            continue
+        if isinstance(blob, unicode):
+            # The Python 2 csv module only reads byte strings
+            blob = blob.encode('utf-8')
+        # Keep the line ends so quoted descriptions may span lines
+        rows = reader(blob.splitlines(True))
+        header = next(rows, None)
+        if header is None:
+            continue
+        positions = [header.index(column) if column in header else None for column in wanted]
+        width = len(header)
+        count = 0
+        for row in rows:
+            if not row:
+                continue
+            if len(row) < width:
+                row += [''] * (width - len(row))
+            for target, position in zip(targets, positions):
+                target.append(row[position] if position is not None else '')
+            count += 1
+        invoice_ids.extend([invoice['id']] * count)
+
+    return LineItems(
+        invoice_ids,
+        [value.decode('utf-8') for value in text['kind']],
+        [value.decode('utf-8') for value in text['description']],
+        *[_floats(numbers[column]) for column in NUMERIC_COLUMNS]
+    )
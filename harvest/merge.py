@@ -0,0 +1,110 @@
+"""
+ merge.py
+
+ Bounded-memory chronological merge of time entries across projects.
+
+ ExternalSorter keeps at most `max_records` records in memory.  When the
+ buffer is full it is sorted and spilled to a temporary file as a run; the
+ runs are then k-way merged (in several passes when there are more than
+ `fan_in` of them) into one ordered stream.  merge_timesheets() feeds it the
+ streamed timesheets of every project, so accounts of any size can be
+ exported in spent_at/user order on small workers.
+"""
+from __future__ import print_function
+
+import json
+import heapq
+import tempfile
+
+
+def entry_sort_key(record):
+    """ Payroll order of a time entry: spent_at, then user, then entry id """
+    entry = record.get('day_entry', record)
+    return (entry.get('spent_at'), entry.get('user_id'), entry.get('id'))
+
+
+def _read_run(run, index):
+    """ Decorated records of a spilled run: (key, run index, position, record) """
+    run.seek(0)
+    for position, line in enumerate(run):
+        key, record = json.loads(line.decode('utf-8'))
+        yield key, index, position, record
+
+
+class ExternalSorter(object):
+    """
+    Sort an unbounded number of records with at most `max_records` of
+    them in memory.
+
+    - key: sort key of a record; must survive a JSON round trip
+    - fan_in: most runs merged (and so files open) at once
+    - tmpdir: directory of the spilled runs (system default when None)
+    """
+    def __init__(self, key=entry_sort_key, max_records=100000, fan_in=64, tmpdir=None):
+        self.key = key
+        self.max_records = max_records
+        self.fan_in = fan_in
+        self.tmpdir = tmpdir
+        self.spilled = 0
+        self._buffer = []
+        self._runs = []
+
+    def add(self, record):
+        """ Add one record, spilling a sorted run when the buffer is full """
+        self._buffer.append(record)
+        if len(self._buffer) >= self.max_records:
+            self._spill()
+
+    def extend(self, records):
+        """ Add every record of an iterable """
+        for record in records:
+            self.add(record)
+
+    def __iter__(self):
+        """ Records in key order; the sorter is empty afterwards """
+        if not self._runs:
+            records, self._buffer = self._buffer, []
+            records.sort(key=self.key)
+            return iter(records)
+        if self._buffer:
+            self._spill()
+        while len(self._runs) > self.fan_in:
+            runs, self._runs = self._runs[:self.fan_in], self._runs[self.fan_in:]
+            self._runs.append(self._write_run(record for _, _, _, record in self._merge(runs)))
+        runs, self._runs = self._runs, []
+        return (record for _, _, _, record in self._merge(runs))
+
+    # Internal methods
+
+    def _spill(self):
+        self._buffer.sort(key=self.key)
+        self._runs.append(self._write_run(self._buffer))
+        self.spilled += len(self._buffer)
+        self._buffer = []
+
+    def _write_run(self, records):
+        run = tempfile.TemporaryFile(dir=self.tmpdir)
+        for record in records:
+            run.write(json.dumps([self.key(record), record]).encode('utf-8'))
+            run.write(b'\n')
+        return run
+
+    def _merge(self, runs):
+        try:
+            for item in heapq.merge(*[_read_run(run, index) for index, run in enumerate(runs)]):
+                yield item
+        finally:
+            for run in runs:
+                run.close()
+
+
+def merge_timesheets(client, project_ids, start_date, end_date, max_records=100000,
+                     key=entry_sort_key, tmpdir=None):
+    """
+    Every time entry of `project_ids` between the dates, as one stream
+    ordered by spent_at and user, holding at most `max_records` in memory.
+    """
+    sorter = ExternalSorter(key=key, max_records=max_records, tmpdir=tmpdir)
+    for project_id in project_ids:
+        sorter.extend(client.timesheets_for_project(project_id, start_date, end_date, stream=True))
+    return iter(sorter)
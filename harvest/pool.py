@@ -0,0 +1,234 @@
+"""
+ pool.py
+
+ HarvestPool: one place to run work against many Harvest accounts.
+
+ Accounts on the same host share one connection pool, every request is
+ charged to a per-account token bucket and an optional global one, and
+ queued jobs are handed to the workers round-robin across accounts so a
+ large account cannot starve the others.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import threading
+from collections import deque
+from urlparse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from .harvest import Harvest, HarvestError
+from .ratelimit import TokenBucket, HARVEST_RATE, HARVEST_BURST
+
+
+class PoolJob(object):
+    """ Handle on a unit of work submitted to a HarvestPool """
+    def __init__(self, account, fn, args, kwargs):
+        self.account = account
+        self._call = (fn, args, kwargs)
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        """ True once the job has run """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the job and return its result, re-raising its exception """
+        if not self._done.wait(timeout):
+            raise HarvestError('Job for account "{0}" did not finish in time'.format(self.account))
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def _run(self, client):
+        fn, args, kwargs = self._call
+        try:
+            self._result = fn(client, *args, **kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        return self._exc_info is None
+
+
+class _AccountBudget(object):
+    """ Limiter handed to each account's client: account bucket, then global bucket """
+    def __init__(self, bucket, global_bucket):
+        self.bucket = bucket
+        self.global_bucket = global_bucket
+        self.started = time.time()
+        self.requests = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        waited = self.bucket.acquire()
+        if self.global_bucket is not None:
+            waited += self.global_bucket.acquire()
+        with self._lock:
+            self.requests += 1
+            self.waited += waited
+
+    def try_acquire(self):
+        """ Take one request from both budgets if both allow it right now """
+        if not self.bucket.try_acquire():
+            return False
+        if self.global_bucket is not None and not self.global_bucket.try_acquire():
+            self.bucket.refund()
+            return False
+        with self._lock:
+            self.requests += 1
+        return True
+
+    def delay(self):
+        """ Seconds until both budgets allow a request """
+        if self.global_bucket is None:
+            return self.bucket.delay()
+        return max(self.bucket.delay(), self.global_bucket.delay())
+
+
+class HarvestPool(object):
+    """
+    Pool of Harvest clients for many accounts.
+
+    - workers: threads running submitted jobs
+    - max_per_account: jobs of one account allowed to run at the same time
+    - account_rate / account_burst: per-account request budget
+    - global_rate / global_burst: optional budget shared by all accounts
+    """
+    def __init__(self, workers=8, max_per_account=2,
+                 account_rate=HARVEST_RATE, account_burst=HARVEST_BURST,
+                 global_rate=None, global_burst=None):
+        self.max_per_account = max_per_account
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.global_bucket = None
+        if global_rate is not None:
+            self.global_bucket = TokenBucket(global_rate, global_burst or global_rate)
+        self._adapter_size = workers
+        self._adapters = {}
+        self._clients = {}
+        self._budgets = {}
+        self._queues = {}
+        self._running = {}
+        self._completed = {}
+        self._errors = {}
+        self._order = []
+        self._next = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, name='harvest-pool-{0}'.format(i))
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def add_account(self, name, uri, **kwargs):
+        """
+        Register an account; kwargs are passed on to Harvest (credentials,
+        breaker, differ, ...).  Returns the account's client.
+        """
+        host = urlparse(uri).netloc
+        with self._cond:
+            if name in self._clients:
+                raise HarvestError('Account "{0}" is already in the pool.'.format(name))
+            adapter = self._adapters.get(host)
+            if adapter is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._adapter_size)
+                self._adapters[host] = adapter
+            budget = _AccountBudget(TokenBucket(self.account_rate, self.account_burst),
+                                    self.global_bucket)
+            client = Harvest(uri, adapter=adapter, limiter=budget, **kwargs)
+            self._clients[name] = client
+            self._budgets[name] = budget
+            self._queues[name] = deque()
+            self._running[name] = 0
+            self._completed[name] = 0
+            self._errors[name] = 0
+            self._order.append(name)
+        return client
+
+    def client(self, name):
+        """ Client of a registered account """
+        return self._clients[name]
+
+    @property
+    def accounts(self):
+        """ names of the registered accounts """
+        return list(self._order)
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        Queue fn(client, *args, **kwargs) for the account `name`, e.g.
+        pool.submit('acme', Harvest.timesheets_for_project, project_id, start, end)
+        """
+        job = PoolJob(name, fn, args, kwargs)
+        with self._cond:
+            if self._closed:
+                raise HarvestError('HarvestPool is closed.')
+            self._queues[name].append(job)
+            self._cond.notify()
+        return job
+
+    def stats(self):
+        """ Per-account throughput and queue figures """
+        now = time.time()
+        with self._cond:
+            stats = {}
+            for name in self._order:
+                budget = self._budgets[name]
+                elapsed = max(now - budget.started, 1e-9)
+                stats[name] = {
+                    'requests': budget.requests,
+                    'requests_per_sec': budget.requests / elapsed,
+                    'rate_limit_wait': budget.waited,
+                    'jobs_completed': self._completed[name],
+                    'jobs_failed': self._errors[name],
+                    'jobs_running': self._running[name],
+                    'jobs_pending': len(self._queues[name]),
+                }
+            return stats
+
+    def close(self, wait=True):
+        """ Stop accepting jobs; with `wait` block until queued jobs have run """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    # Internal methods
+
+    def _next_job(self):
+        """ Next runnable job, round-robin over accounts (call with the lock held) """
+        total = len(self._order)
+        for step in range(total):
+            name = self._order[(self._next + step) % total]
+            if self._queues[name] and self._running[name] < self.max_per_account:
+                self._next = (self._next + step + 1) % total
+                self._running[name] += 1
+                return self._queues[name].popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._closed and not any(self._queues.values()):
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                client = self._clients[job.account]
+            succeeded = job._run(client)
+            with self._cond:
+                self._running[job.account] -= 1
+                self._completed[job.account] += 1
+                if not succeeded:
+                    self._errors[job.account] += 1
+                self._cond.notify_all()
+            job._done.set()
@@ -0,0 +1,74 @@
+"""
+ ratelimit.py
+
+ Thread-safe token buckets used to keep request rates under Harvest's limits.
+"""
+from __future__ import print_function
+
+import time
+import threading
+
+# Harvest allows 100 requests per 15 seconds for each account
+HARVEST_RATE = 100 / 15.0
+HARVEST_BURST = 100
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most
+    `capacity` tokens.
+    """
+    def __init__(self, rate=HARVEST_RATE, capacity=HARVEST_BURST, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    @property
+    def tokens(self):
+        """ tokens currently available """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self, tokens=1):
+        """ Take `tokens` if they are available right now; returns True on success """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def delay(self, tokens=1):
+        """ Seconds until `tokens` are available (0 when they are now) """
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def refund(self, tokens=1):
+        """ Give back tokens taken but not used """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def acquire(self, tokens=1):
+        """ Take `tokens`, sleeping until they are available; returns the time waited """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
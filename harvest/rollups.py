@@ -0,0 +1,235 @@
+"""
+ rollups.py
+
+ Incrementally maintained hours and billing aggregates.
+
+ Rollups keeps materialised totals (hours, billable hours, expenses) per
+ project, client, user and task, each overall and per day, week and month.
+ Every entry's last contribution is remembered by id, so an entry that comes
+ back changed only moves its old contribution out and the new one in.
+ refresh() fetches just the entries updated since the previous refresh, and
+ on_event() follows a watch_daily() subscription; dashboard queries are then
+ dictionary lookups instead of a re-fetch of every project.  refresh() keeps
+ one watermark per project, kind of record and date window: a project added
+ to the list, or a new window, is loaded in full rather than from another
+ one's watermark.  Watermarks only move with what refresh() itself fetched,
+ so events from the watcher never make it skip older changes.
+"""
+from __future__ import print_function
+
+import threading
+from datetime import date
+from collections import namedtuple
+
+from .watch import REMOVED
+
+DIMENSIONS = ('project', 'client', 'user', 'task')
+BUCKETS = ('day', 'week', 'month')
+
+Totals = namedtuple('Totals', ['hours', 'billable_hours', 'expenses'])
+ZERO = Totals(0.0, 0.0, 0.0)
+
+
+def _id(value):
+    """ Ids arrive as ints from most endpoints and as strings from /daily """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def bucket_periods(spent_at):
+    """ {bucket: period} of a 'YYYY-MM-DD' date, e.g. week '2016-W03' """
+    try:
+        year, month, day = map(int, str(spent_at)[:10].split('-'))
+        spent = date(year, month, day)
+    except ValueError:
+        return {}
+    iso_year, iso_week, _ = spent.isocalendar()
+    return {
+        'day': spent.isoformat(),
+        'week': '{0}-W{1:02d}'.format(iso_year, iso_week),
+        'month': '{0:04d}-{1:02d}'.format(year, month),
+    }
+
+
+def _is_billable(entry):
+    return bool(entry.get('billable', entry.get('is_billable')))
+
+
+class Rollups(object):
+    """
+    Totals of time entries and expenses, kept up to date from changes only.
+
+    - project_clients: {project_id: client_id}, needed for the client rollups
+    - billable: predicate telling whether a time entry is billable; defaults
+      to the entry's own `billable` flag
+    - buckets: time buckets maintained besides the overall totals
+
+    Rollups are safe to query from one thread while another applies changes.
+    """
+    def __init__(self, project_clients=None, billable=_is_billable, buckets=BUCKETS):
+        self.project_clients = dict((_id(p), _id(c)) for p, c in (project_clients or {}).items())
+        self.billable = billable
+        self.buckets = tuple(buckets)
+        self._watermarks = {}       # (project_id, kind, start_date, end_date) -> latest `updated_at` fetched
+        self._lock = threading.Lock()
+        self._totals = {}           # (dimension, value, bucket, period) -> [hours, billable, expenses, entries]
+        self._values = {}           # (dimension, bucket, period) -> values with totals
+        self._periods = {}          # (dimension, value, bucket) -> periods with totals
+        self._contributions = {}    # (kind, id) -> (keys, values)
+
+    def apply(self, record):
+        """ Add a `day_entry` or `expense` record, replacing its previous version """
+        kind, item = self._unwrap(record)
+        keys, values = self._contribution(kind, item)
+        with self._lock:
+            self._retract((kind, _id(item['id'])))
+            self._add(keys, values, 1)
+            self._contributions[(kind, _id(item['id']))] = (keys, values)
+
+    def extend(self, records):
+        """ Apply every record of an iterable """
+        for record in records:
+            self.apply(record)
+
+    def remove(self, record):
+        """ Take a deleted `day_entry` or `expense` out of the totals """
+        kind, item = self._unwrap(record)
+        with self._lock:
+            self._retract((kind, _id(item['id'])))
+
+    def on_event(self, event):
+        """ Callback for Harvest.watch_daily(): follow today's entries as they change """
+        if event.kind == REMOVED:
+            self.remove(event.entry)
+        else:
+            self.apply(event.entry)
+
+    def refresh(self, client, project_ids, start_date, end_date, expenses=True):
+        """
+        Apply the entries (and expenses) of `project_ids` updated since they
+        were last refreshed for the same window; the first refresh of a
+        project and window loads the whole period.  Deletions are not reported
+        by `updated_since`: follow them with on_event() or rebuild.
+        """
+        count = 0
+        for project_id in project_ids:
+            fetches = [('day_entry', client.timesheets_for_project)]
+            if expenses:
+                fetches.append(('expense', client.expenses_for_project))
+            for kind, fetch in fetches:
+                key = (_id(project_id), kind, start_date, end_date)
+                since = latest = self._watermarks.get(key)
+                for record in fetch(project_id, start_date, end_date, updated_since=since, stream=True):
+                    self.apply(record)
+                    count += 1
+                    updated_at = self._unwrap(record)[1].get('updated_at')
+                    if updated_at and (latest is None or updated_at > latest):
+                        latest = updated_at
+                # Only a complete fetch moves the watermark
+                if latest is not None:
+                    self._watermarks[key] = latest
+        return count
+
+    @property
+    def updated_at(self):
+        """ latest `updated_at` fetched by refresh(), over every project and window """
+        return max(self._watermarks.values()) if self._watermarks else None
+
+    def total(self, dimension=None, value=None, bucket=None, period=None):
+        """
+        Totals of one project/client/user/task (or of everything when
+        `dimension` is None), overall or for one bucket period, e.g.
+        total('project', 42, 'week', '2016-W03')
+        """
+        with self._lock:
+            totals = self._totals.get((dimension, _id(value), bucket, period))
+            return ZERO if totals is None else Totals(*totals[:3])
+
+    def breakdown(self, dimension, bucket=None, period=None):
+        """ {value: Totals} of every project/client/user/task with entries in the period """
+        with self._lock:
+            values = list(self._values.get((dimension, bucket, period), ()))
+            return dict((value, Totals(*self._totals[(dimension, value, bucket, period)][:3]))
+                        for value in values)
+
+    def series(self, dimension, value, bucket):
+        """ {period: Totals} of one project/client/user/task per day, week or month """
+        value = _id(value)
+        with self._lock:
+            periods = list(self._periods.get((dimension, value, bucket), ()))
+            return dict((period, Totals(*self._totals[(dimension, value, bucket, period)][:3]))
+                        for period in periods)
+
+    def __len__(self):
+        return len(self._contributions)
+
+    # Internal methods
+
+    @staticmethod
+    def _unwrap(record):
+        if 'expense' in record:
+            return 'expense', record['expense']
+        return 'day_entry', record.get('day_entry', record)
+
+    def _contribution(self, kind, item):
+        project_id = _id(item.get('project_id'))
+        values = {
+            'project': project_id,
+            'client': self.project_clients.get(project_id),
+            'user': _id(item.get('user_id')),
+            'task': _id(item.get('task_id')),
+        }
+        if kind == 'expense':
+            amounts = (0.0, 0.0, _number(item.get('total_cost')))
+        else:
+            hours = _number(item.get('hours'))
+            amounts = (hours, hours if self.billable(item) else 0.0, 0.0)
+
+        periods = bucket_periods(item.get('spent_at'))
+        scopes = [(None, None)] + [(bucket, periods[bucket]) for bucket in self.buckets if bucket in periods]
+        keys = []
+        for bucket, period in scopes:
+            keys.append((None, None, bucket, period))
+            for dimension in DIMENSIONS:
+                if values[dimension] is not None:
+                    keys.append((dimension, values[dimension], bucket, period))
+        return tuple(keys), amounts
+
+    def _retract(self, key):
+        previous = self._contributions.pop(key, None)
+        if previous is not None:
+            self._add(previous[0], previous[1], -1)
+
+    def _add(self, keys, amounts, sign):
+        for key in keys:
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = [0.0, 0.0, 0.0, 0]
+                self._index(key, add=True)
+            for i in range(3):
+                totals[i] += sign * amounts[i]
+            totals[3] += sign
+            if not totals[3]:
+                del self._totals[key]
+                self._index(key, add=False)
+
+    def _index(self, key, add):
+        dimension, value, bucket, period = key
+        for index, group, member in ((self._values, (dimension, bucket, period), value),
+                                     (self._periods, (dimension, value, bucket), period)):
+            if add:
+                index.setdefault(group, set()).add(member)
+            else:
+                members = index[group]
+                members.discard(member)
+                if not members:
+                    del index[group]
@@ -0,0 +1,143 @@
+"""
+ scheduler.py
+
+ Priority-aware request scheduler for a Harvest client.
+
+ Every request takes a slot before it is sent.  Waiting interactive requests
+ are always served before normal ones, and normal ones before batch ones.
+ Batch traffic may only hold a share of the slots (and optionally draws from
+ its own token bucket), so user-facing calls keep some headroom during a crawl.
+ The client's rate limiter is consulted in the same order: a request waits
+ for its token in the queue, without a slot, so an interactive call arriving
+ meanwhile still gets the next token.
+"""
+from __future__ import print_function
+
+import time
+import threading
+from collections import deque
+from itertools import count
+
+from .harvest import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH
+from .ratelimit import TokenBucket
+
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH)
+
+
+class _ClassMetrics(object):
+    """ Queue depth and wait time figures of one priority class """
+    def __init__(self):
+        self.queued = 0
+        self.max_queued = 0
+        self.running = 0
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        return {
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'running': self.running,
+            'requests': self.requests,
+            'total_wait': self.total_wait,
+            'max_wait': self.max_wait,
+            'mean_wait': self.total_wait / self.requests if self.requests else 0.0,
+        }
+
+
+class RequestScheduler(object):
+    """
+    Hands out request slots by priority class.
+
+    - max_concurrency: requests in flight at once, all classes together
+    - batch_share: fraction of the slots batch requests may hold
+    - batch_rate / batch_burst: optional requests per second allowed to batch traffic
+    """
+    def __init__(self, max_concurrency=4, batch_share=0.5, batch_rate=None, batch_burst=None):
+        self.max_concurrency = max_concurrency
+        self.batch_slots = max(1, int(max_concurrency * batch_share))
+        self.batch_bucket = None
+        if batch_rate is not None:
+            self.batch_bucket = TokenBucket(batch_rate, batch_burst or batch_rate)
+        self._cond = threading.Condition()
+        self._tickets = count()
+        self._waiting = dict((priority, deque()) for priority in PRIORITIES)
+        self._metrics = dict((priority, _ClassMetrics()) for priority in PRIORITIES)
+        self._running = 0
+
+    def acquire(self, priority=PRIORITY_NORMAL, limiter=None):
+        """
+        Block until a request of `priority` may be sent.  `limiter` is the
+        client's rate limiter; one with try_acquire() and delay() (such as a
+        TokenBucket) is drawn from in priority order, any other is acquired
+        before queueing.
+        """
+        if priority not in self._waiting:
+            priority = PRIORITY_NORMAL
+        if limiter is not None and not hasattr(limiter, 'try_acquire'):
+            limiter.acquire()
+            limiter = None
+        buckets = [limiter] if limiter is not None else []
+        if priority == PRIORITY_BATCH and self.batch_bucket is not None:
+            buckets.append(self.batch_bucket)
+        start = time.time()
+        metrics = self._metrics[priority]
+        with self._cond:
+            ticket = next(self._tickets)
+            self._waiting[priority].append(ticket)
+            metrics.queued += 1
+            metrics.max_queued = max(metrics.max_queued, metrics.queued)
+            while True:
+                if self._may_run(priority, ticket):
+                    delay = self._take(buckets)
+                    if not delay:
+                        break
+                    # Out of budget: stay first in line, without a slot
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            self._waiting[priority].popleft()
+            metrics.queued -= 1
+            metrics.running += 1
+            self._running += 1
+            waited = time.time() - start
+            metrics.requests += 1
+            metrics.total_wait += waited
+            metrics.max_wait = max(metrics.max_wait, waited)
+            # The next waiter of this class may be runnable too
+            self._cond.notify_all()
+
+    def release(self, priority=PRIORITY_NORMAL):
+        """ Give back the slot taken by acquire() """
+        if priority not in self._waiting:
+            priority = PRIORITY_NORMAL
+        with self._cond:
+            self._metrics[priority].running -= 1
+            self._running -= 1
+            self._cond.notify_all()
+
+    def metrics(self):
+        """ Per-class queue depth and wait time figures, keyed by priority """
+        with self._cond:
+            return dict((priority, self._metrics[priority].as_dict()) for priority in PRIORITIES)
+
+    def _take(self, buckets):
+        """ Take a token from every bucket, or none and return the seconds to wait """
+        for i, bucket in enumerate(buckets):
+            if not bucket.try_acquire():
+                for taken in buckets[:i]:
+                    taken.refund()
+                return max(bucket.delay(), 0.001)
+        return 0
+
+    def _may_run(self, priority, ticket):
+        """ Whether the waiter holding `ticket` can take a slot (call with the lock held) """
+        if self._waiting[priority][0] != ticket or self._running >= self.max_concurrency:
+            return False
+        if any(self._waiting[higher] for higher in PRIORITIES if higher < priority):
+            return False
+        if priority == PRIORITY_BATCH and \
+                self._metrics[PRIORITY_BATCH].running >= self.batch_slots:
+            return False
+        return True
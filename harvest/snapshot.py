@@ -0,0 +1,253 @@
+"""
+ snapshot.py
+
+ Read-only, memory-mapped snapshots of Harvest reference data.
+
+ publish_snapshot() fetches projects, clients, people and tasks once and
+ writes them to a compact binary file.  Every worker process then opens the
+ file with Snapshot, which maps it read-only (the OS shares the pages between
+ processes) and looks records up by id in O(1) through an open-addressing
+ hash table stored in the file.  A refreshed snapshot is published by
+ writing a temporary file and renaming it over the old one, so readers
+ always see either the old or the new file, never a partial one.
+
+ File layout (little-endian):
+   header     MAGIC, dataset count (I)
+   directory  per dataset: name length (H), name, table offset (Q),
+              slot count (I), record count (I)
+   tables     per dataset: slots of id (q), record offset (Q), record length (I)
+   records    JSON documents, as returned by the API
+"""
+from __future__ import print_function
+
+import os
+import json
+import mmap
+import time
+import struct
+import tempfile
+
+from .harvest import HarvestError
+
+MAGIC = b'HVSNAP01'
+_COUNT = struct.Struct('<I')
+_NAME = struct.Struct('<H')
+_DIRECTORY = struct.Struct('<QII')
+_SLOT = struct.Struct('<qQI')
+
+# Reference datasets, named after the Harvest methods returning them
+REFERENCE_DATASETS = ('projects', 'clients', 'people', 'tasks')
+
+
+def _coerce_id(record_id):
+    """ Ids as stored in the tables, or None for ids that cannot be (e.g. '42' -> 42) """
+    try:
+        return int(record_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _slot_index(record_id, mask):
+    """ Home slot of an id (Fibonacci hashing) """
+    return ((record_id * 2654435761) & 0xffffffffffffffff) & mask
+
+
+def _record_id(record):
+    """ Id of an API record, which is wrapped in a single key: {"project": {"id": ...}} """
+    if isinstance(record, dict) and len(record) == 1:
+        record = list(record.values())[0]
+    if isinstance(record, dict):
+        return record.get('id')
+    return None
+
+
+def write_snapshot(path, datasets):
+    """
+    Write `datasets` ({name: list of records}) to `path`, atomically
+    replacing any previous snapshot.  When an id occurs more than once in a
+    dataset the last record wins.
+    """
+    names = sorted(datasets)
+    encoded = []
+    for name in names:
+        records = {}
+        for record in datasets[name]:
+            record_id = _coerce_id(_record_id(record))
+            if record_id is not None:
+                records[record_id] = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        records = sorted(records.items())
+        slots = 1
+        while slots < 2 * len(records):
+            slots *= 2
+        encoded.append((name.encode('utf-8'), slots, records))
+
+    offset = len(MAGIC) + _COUNT.size + sum(
+        _NAME.size + len(name) + _DIRECTORY.size for name, _, _ in encoded)
+    directory = []
+    for name, slots, records in encoded:
+        directory.append((name, offset, slots, len(records)))
+        offset += slots * _SLOT.size
+
+    tables = []
+    for name, slots, records in encoded:
+        table = [(0, 0, 0)] * slots
+        mask = slots - 1
+        for record_id, data in records:
+            index = _slot_index(record_id, mask)
+            while table[index][2]:
+                index = (index + 1) & mask
+            table[index] = (record_id, offset, len(data))
+            offset += len(data)
+        tables.append(table)
+
+    directory_name = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory_name)
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(MAGIC)
+            handle.write(_COUNT.pack(len(encoded)))
+            for name, table_offset, slots, count in directory:
+                handle.write(_NAME.pack(len(name)))
+                handle.write(name)
+                handle.write(_DIRECTORY.pack(table_offset, slots, count))
+            for table in tables:
+                handle.write(b''.join(_SLOT.pack(*slot) for slot in table))
+            for _, _, records in encoded:
+                for _, data in records:
+                    handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def publish_snapshot(client, path, datasets=REFERENCE_DATASETS):
+    """ Fetch the reference datasets through `client` and publish them to `path` """
+    data = {}
+    for name in datasets:
+        records = getattr(client, name)()
+        if not isinstance(records, list):
+            raise HarvestError('Could not fetch {0} for the snapshot: {1}'.format(name, records))
+        data[name] = records
+    write_snapshot(path, data)
+
+
+class Snapshot(object):
+    """
+    Read-only view of a snapshot file.
+
+    With `check_interval` (seconds) lookups notice a newly published
+    snapshot and switch to it; otherwise call reload() explicitly.
+    """
+    def __init__(self, path, check_interval=None):
+        self.path = path
+        self.check_interval = check_interval
+        self._view = (None, {})
+        self._stat = None
+        self._checked = 0
+        self._open()
+
+    @property
+    def datasets(self):
+        """ names of the datasets in the snapshot """
+        return sorted(self._view[1])
+
+    def count(self, dataset):
+        """ Number of records in a dataset """
+        self._maybe_reload()
+        return self._view[1][dataset][2]
+
+    def get_raw(self, dataset, record_id):
+        """
+        Zero-copy buffer over the JSON of one record, or None when the id is
+        not in the dataset; ids may be given as ints or numeric strings
+        """
+        record_id = _coerce_id(record_id)
+        if record_id is None:
+            return None
+        self._maybe_reload()
+        mapped, tables = self._view
+        table_offset, slots, _ = tables[dataset]
+        mask = slots - 1
+        index = _slot_index(record_id, mask)
+        while True:
+            slot_id, offset, length = _SLOT.unpack_from(mapped, table_offset + index * _SLOT.size)
+            if not length:
+                return None
+            if slot_id == record_id:
+                return buffer(mapped, offset, length)
+            index = (index + 1) & mask
+
+    def get(self, dataset, record_id):
+        """ Decoded record by id, or None """
+        raw = self.get_raw(dataset, record_id)
+        if raw is None:
+            return None
+        return json.loads(str(raw))
+
+    def records(self, dataset):
+        """ Iterate over the decoded records of a dataset """
+        self._maybe_reload()
+        mapped, tables = self._view
+        table_offset, slots, _ = tables[dataset]
+        for index in range(slots):
+            _, offset, length = _SLOT.unpack_from(mapped, table_offset + index * _SLOT.size)
+            if length:
+                yield json.loads(mapped[offset:offset + length])
+
+    def reload(self):
+        """ Switch to the file currently published at the path if it was replaced """
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime) != self._stat:
+            self._open()
+            return True
+        return False
+
+    def close(self):
+        """ Unmap the snapshot """
+        mapped = self._view[0]
+        self._view = (None, {})
+        if mapped is not None:
+            mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Internal methods
+
+    def _maybe_reload(self):
+        if self.check_interval is None:
+            return
+        now = time.time()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self.reload()
+
+    def _open(self):
+        with open(self.path, 'rb') as handle:
+            stat = os.fstat(handle.fileno())
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise HarvestError('"{0}" is not a Harvest snapshot.'.format(self.path))
+        pos = len(MAGIC)
+        (count,) = _COUNT.unpack_from(mapped, pos)
+        pos += _COUNT.size
+        tables = {}
+        for _ in range(count):
+            (length,) = _NAME.unpack_from(mapped, pos)
+            pos += _NAME.size
+            name = mapped[pos:pos + length].decode('utf-8')
+            pos += length
+            tables[name] = _DIRECTORY.unpack_from(mapped, pos)
+            pos += _DIRECTORY.size
+        # The previous map stays alive as long as buffers returned by get_raw use it
+        self._view = (mapped, tables)
+        self._stat = (stat.st_ino, stat.st_mtime)
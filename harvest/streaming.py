@@ -0,0 +1,112 @@
+"""
+ streaming.py
+
+ Incremental parsing of JSON array responses.
+
+ iter_json_array() reads a response body chunk by chunk and yields each
+ element of the top-level array as soon as its closing bracket arrives, so
+ the first records are available before the body is complete and memory is
+ bounded by the size of a single record.
+"""
+from __future__ import print_function
+
+import re
+import json
+
+# Characters that matter outside strings, and inside them
+_STRUCTURE = re.compile(br'["{}\[\],]')
+_STRING = re.compile(br'["\\]')
+_WHITESPACE = b' \t\r\n'
+
+
+def _decode(parts):
+    return json.loads(b''.join(parts).decode('utf-8'))
+
+
+def iter_json_array(chunks):
+    """
+    Yield the elements of the JSON array spread over the byte strings
+    `chunks`.  A body that is not an array (e.g. an error message) is
+    yielded whole, as a single item.  Raises ValueError when the array is
+    cut short.
+    """
+    started = False
+    whole = None        # collects a body that is not an array
+    parts = []          # pieces of the element being read
+    in_element = False
+    in_string = False
+    escaped = False
+    depth = 0
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if whole is not None:
+            whole.append(chunk)
+            continue
+        i, end = 0, len(chunk)
+        while i < end:
+            if not started:
+                char = chunk[i:i + 1]
+                if char in _WHITESPACE:
+                    i += 1
+                elif char == b'[':
+                    started = True
+                    i += 1
+                else:
+                    whole = [chunk[i:]]
+                    break
+            elif not in_element:
+                char = chunk[i:i + 1]
+                if char in _WHITESPACE or char == b',':
+                    i += 1
+                elif char == b']':
+                    return
+                else:
+                    in_element, start, depth = True, i, 0
+            elif in_string:
+                if escaped:
+                    escaped = False
+                    i += 1
+                    continue
+                match = _STRING.search(chunk, i)
+                if match is None:
+                    i = end
+                elif match.group() == b'\\':
+                    escaped = True
+                    i = match.end()
+                else:
+                    in_string = False
+                    i = match.end()
+            else:
+                match = _STRUCTURE.search(chunk, i)
+                if match is None:
+                    i = end
+                    continue
+                char, i = match.group(), match.end()
+                if char == b'"':
+                    in_string = True
+                elif char in b'{[':
+                    depth += 1
+                elif depth and char in b'}]':
+                    depth -= 1
+                    if not depth:
+                        parts.append(chunk[start:i])
+                        yield _decode(parts)
+                        parts, in_element = [], False
+                elif not depth:
+                    # ',' or ']' ending a scalar element
+                    parts.append(chunk[start:i - 1])
+                    yield _decode(parts)
+                    parts, in_element = [], False
+                    if char == b']':
+                        return
+        if in_element:
+            parts.append(chunk[start:])
+            start = 0
+
+    if whole is not None:
+        yield _decode(whole)
+    elif started:
+        # The closing bracket returns above: the body was truncated
+        raise ValueError('Truncated JSON array')
@@ -0,0 +1,153 @@
+"""
+ transport.py
+
+ Pluggable transports used by the Harvest client to send its requests.
+
+ Transport sends straight to the API.  RecordingTransport wraps another
+ transport and captures every request/response pair with its timing into a
+ gzipped JSON-lines file; ReplayTransport serves such a file back without
+ touching the network, either at full speed or at the recorded latencies.
+ Request headers (and so credentials) are never written to the recording.
+"""
+from __future__ import print_function
+
+import gzip
+import json
+import time
+import threading
+from base64 import b64encode, b64decode
+from collections import defaultdict, deque
+from datetime import timedelta
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+def make_response(status=200, body='', url=None, headers=None, elapsed=0.0):
+    """
+    Build a requests.Response without the network, e.g. in a stand-in
+    Transport.  `body` is text, bytes, or any other value to send as JSON.
+    """
+    if not isinstance(body, (bytes, unicode)):
+        body = json.dumps(body)
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.url = url
+    resp.elapsed = timedelta(seconds=elapsed)
+    resp._content = body
+    resp._content_consumed = True
+    return resp
+
+
+def _key(method, url, data):
+    """ Lookup key of a recorded exchange """
+    return '{0} {1} {2}'.format(method, url, data)
+
+
+class Transport(object):
+    """
+    Default transport: send the request with the requestor chosen by the
+    client (the requests module or an OAuth2Session)
+    """
+    def send(self, requestor, **kwargs):
+        """ Send a request and return a requests.Response """
+        return requestor.request(**kwargs)
+
+    def close(self):
+        """ Release any resources held by the transport """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingTransport(Transport):
+    """
+    Transport capturing every exchange to `path` while forwarding it to
+    `inner` (a plain Transport by default)
+    """
+    def __init__(self, path, inner=None):
+        self.path = path
+        self.inner = inner or Transport()
+        self._lock = threading.Lock()
+        self._handle = gzip.open(path, 'wb')
+
+    def send(self, requestor, **kwargs):
+        start = time.time()
+        resp = self.inner.send(requestor, **kwargs)
+        content = resp.content
+        record = {
+            'method': kwargs.get('method'),
+            'url': kwargs.get('url'),
+            'data': kwargs.get('data'),
+            'status': resp.status_code,
+            'headers': dict(resp.headers),
+            'elapsed': time.time() - start,
+        }
+        try:
+            record['body'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            record['body_b64'] = b64encode(content).decode('ascii')
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._handle.write(line.encode('utf-8'))
+        return resp
+
+    def close(self):
+        with self._lock:
+            if not self._handle.closed:
+                self._handle.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Transport answering requests from a file written by RecordingTransport.
+
+    Repeated identical requests are answered in recorded order; the last
+    recorded answer is reused once they run out.  With `realtime` each
+    answer is delayed by its recorded latency divided by `speed`.
+    """
+    def __init__(self, path, realtime=False, speed=1.0):
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._exchanges = defaultdict(deque)
+        handle = gzip.open(path, 'rb')
+        try:
+            for line in handle:
+                record = json.loads(line.decode('utf-8'))
+                key = _key(record['method'], record['url'], record['data'])
+                self._exchanges[key].append(record)
+        finally:
+            handle.close()
+
+    def send(self, requestor, **kwargs):
+        key = _key(kwargs.get('method'), kwargs.get('url'), kwargs.get('data'))
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            if not recorded:
+                raise LookupError('No recorded response for {0} {1}'.format(
+                    kwargs.get('method'), kwargs.get('url')))
+            record = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.realtime:
+            time.sleep(record['elapsed'] / self.speed)
+        return self._response(record)
+
+    @staticmethod
+    def _response(record):
+        """ Build a requests.Response from a recorded exchange """
+        if 'body_b64' in record:
+            body = b64decode(record['body_b64'])
+        else:
+            body = record['body'].encode('utf-8')
+        return make_response(record['status'], body, record['url'], record['headers'],
+                             record['elapsed'])
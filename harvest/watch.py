@@ -0,0 +1,199 @@
+"""
+ watch.py
+
+ Change-watch API for daily time entries.
+
+ One DailyWatcher per client polls /daily in a background thread and
+ compares the entries by id and `updated_at` (and timer state) with the
+ previous poll.  Only added, changed and removed entries are delivered to the
+ subscribers, through a callback or by iterating over the subscription.  The
+ poll interval drops to `min_interval` whenever something changed and backs
+ off towards `max_interval` while the day is quiet.  When /daily moves on to
+ a new day the previous day's entries are dropped without 'removed' events,
+ since they were not deleted.
+"""
+from __future__ import print_function
+
+import threading
+from collections import namedtuple
+from Queue import Queue, Empty
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+WatchEvent = namedtuple('WatchEvent', ['kind', 'entry'])
+
+
+def _signature(entry):
+    """ What makes an entry 'changed': hours of a running timer grow on every poll """
+    if 'updated_at' in entry:
+        return (entry.get('updated_at'), entry.get('timer_started_at'))
+    return sorted((key, value) for key, value in entry.items() if key != 'hours')
+
+
+def diff_entries(previous, entries):
+    """
+    Events turning `previous` ({id: entry}) into `entries` (list of entries),
+    and the new {id: entry} mapping
+    """
+    current = dict((entry['id'], entry) for entry in entries)
+    events = []
+    for entry_id, entry in current.items():
+        old = previous.get(entry_id)
+        if old is None:
+            events.append(WatchEvent(ADDED, entry))
+        elif _signature(old) != _signature(entry):
+            events.append(WatchEvent(CHANGED, entry))
+    for entry_id, entry in previous.items():
+        if entry_id not in current:
+            events.append(WatchEvent(REMOVED, entry))
+    return events, current
+
+
+class Subscription(object):
+    """
+    A subscriber of a DailyWatcher.  Events go to `callback` when one was
+    given, otherwise they are queued for iteration.
+    """
+    def __init__(self, watcher, callback=None):
+        self.watcher = watcher
+        self.callback = callback
+        self._queue = Queue()
+        self.active = True
+
+    def events(self, timeout=None):
+        """
+        Yield events as they arrive; stops after `timeout` idle seconds, or
+        once the events queued before cancel() are consumed
+        """
+        while True:
+            try:
+                event = self._queue.get(timeout=timeout)
+            except Empty:
+                return
+            if event is None:
+                return
+            yield event
+
+    def __iter__(self):
+        return self.events()
+
+    def cancel(self):
+        """ Stop receiving events """
+        self.watcher.unsubscribe(self)
+
+    def _deliver(self, events):
+        if self.callback is not None:
+            for event in events:
+                self.callback(event)
+        else:
+            for event in events:
+                self._queue.put(event)
+
+
+class DailyWatcher(object):
+    """
+    Shared poller of a client's daily entries.
+
+    - min_interval / max_interval: bounds of the adaptive poll interval (seconds)
+    - backoff: factor applied to the interval after a poll without changes
+    """
+    def __init__(self, client, min_interval=2.0, max_interval=60.0, backoff=1.5):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.last_error = None
+        self._lock = threading.Lock()
+        # Held while delivering, so a new subscriber's snapshot comes before
+        # any later change; reentrant for callbacks that subscribe
+        self._delivering = threading.RLock()
+        self._local = threading.local()
+        self._subscribers = []
+        self._entries = None
+        self._day = None
+        self._stop = None
+        self._thread = None
+
+    def subscribe(self, callback=None):
+        """
+        Add a subscriber; it first receives the entries already known as
+        'added' events.  Starts the poller if needed.
+        """
+        subscription = Subscription(self, callback)
+        with self._delivering:
+            with self._lock:
+                self._subscribers.append(subscription)
+                known = self._entries
+                if self._thread is None:
+                    self._stop = threading.Event()
+                    self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                                    name='harvest-daily-watch')
+                    self._thread.daemon = True
+                    self._thread.start()
+            if known:
+                self._deliver(subscription, [WatchEvent(ADDED, entry) for entry in known.values()])
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Remove a subscriber; the poller stops with the last one """
+        thread = None
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+            subscription.active = False
+            subscription._queue.put(None)
+            if not self._subscribers and self._thread is not None:
+                self._stop.set()
+                thread, self._thread = self._thread, None
+                self._entries = None
+                self._day = None
+                self.interval = self.min_interval
+        # A callback may cancel; the poller could be waiting for its delivery
+        if thread is not None and not getattr(self._local, 'delivering', False):
+            thread.join()
+
+    def poll(self):
+        """ Fetch the day once and deliver its changes; returns the events """
+        day = self.client.today
+        if not isinstance(day, dict) or 'day_entries' not in day:
+            raise ValueError('Unexpected /daily response: {0}'.format(day))
+        with self._delivering:
+            with self._lock:
+                previous = self._entries or {}
+                if self._day is not None and day.get('for_day') != self._day:
+                    # Day rollover: a fresh day, not a day of removals
+                    previous = {}
+                self._day = day.get('for_day')
+                events, self._entries = diff_entries(previous, day['day_entries'])
+                subscribers = list(self._subscribers)
+            for subscription in subscribers if events else ():
+                try:
+                    self._deliver(subscription, events)
+                except Exception as exc:
+                    # A failing callback must not starve the other subscribers
+                    self.last_error = exc
+        return events
+
+    def _deliver(self, subscription, events):
+        nested, self._local.delivering = getattr(self._local, 'delivering', False), True
+        try:
+            subscription._deliver(events)
+        finally:
+            self._local.delivering = nested
+
+    def _run(self, stop):
+        while not stop.is_set():
+            self.last_error = None
+            try:
+                changed = bool(self.poll())
+            except Exception as exc:
+                changed = False
+                self.last_error = exc
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+            stop.wait(self.interval)
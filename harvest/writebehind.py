@@ -0,0 +1,309 @@
+"""
+ writebehind.py
+
+ Write-behind queue for time entry updates and timer toggles.
+
+ update() and toggle_timer() return as soon as the operation is journaled.
+ Successive updates of the same entry are merged into one write, and two
+ successive toggles of the same timer cancel out.  A background thread sends
+ the pending writes every `interval` seconds, or sooner once `max_pending`
+ operations are waiting.
+
+ Every operation is appended (and fsync'ed) to a local journal before the
+ call returns, and the journal is compacted to the still-pending operations
+ after each flush, so pending writes survive a crash.  Delivery is
+ at-least-once: writes in flight when the process dies are sent again.  A
+ toggle is not safe to repeat, so before it is first sent it is pinned (and
+ journaled) as the timer state it leads to; a resend only toggles when the
+ timer is not in that state yet.  Writes the API refuses (4xx) are dropped
+ and counted; while the API fails (5xx or no answer), flushes back off
+ exponentially up to `max_backoff` seconds.
+"""
+from __future__ import print_function
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from .harvest import PRIORITY_INTERACTIVE
+
+UPDATE = 'update'
+TOGGLE = 'toggle'
+TIMER = 'timer'     # toggle pinned to the state it leads to: {'running': bool}
+
+_GONE = object()    # timer state of an entry the API refuses to show
+
+
+def _merge(old, new):
+    """ Merge update payloads, nested dicts included """
+    merged = dict(old)
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = _merge(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+class WriteBehindQueue(object):
+    """
+    Queue of time entry writes sent in the background through `client`.
+
+    - journal_path: file the pending operations are journaled to
+    - interval: seconds between background flushes
+    - max_pending: number of pending operations that triggers an early flush
+    - max_backoff: longest pause between flushes while the API is failing
+    """
+    def __init__(self, client, journal_path, interval=1.0, max_pending=50, max_backoff=60.0):
+        self.client = client
+        self.journal_path = journal_path
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.dropped = 0
+        self.last_error = None
+        self.failures = 0           # consecutive failed flushes
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._replay()
+        self._journal = open(journal_path, 'a')
+        self._thread = threading.Thread(target=self._run, name='harvest-write-behind')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """ number of operations waiting to be sent """
+        with self._cond:
+            return sum(len(ops) for ops in self._pending.values())
+
+    def update(self, entry_id, data):
+        """ Queue Harvest.update(entry_id, data) """
+        self._enqueue(UPDATE, entry_id, data)
+
+    def toggle_timer(self, entry_id):
+        """ Queue Harvest.toggle_timer(entry_id) """
+        self._enqueue(TOGGLE, entry_id)
+
+    def flush(self):
+        """ Send every pending operation now; returns the number written """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, OrderedDict()
+            if not batch:
+                return 0
+            written = 0
+            retry = OrderedDict()
+            failed = False
+            for entry_id, ops in batch.items():
+                # After a failure keep the rest for the next flush rather than
+                # hammering an API that is not answering
+                while ops and not failed:
+                    op, data = ops[0]
+                    if op == TOGGLE:
+                        running = self._timer_running(entry_id)
+                        if running is None:
+                            failed = True
+                            break
+                        if running is _GONE:
+                            self.dropped += 1
+                            ops.pop(0)
+                            continue
+                        op, data = ops[0] = (TIMER, {'running': not running})
+                        with self._cond:
+                            self._compact(batch)
+                    if not self._send(op, entry_id, data):
+                        failed = True
+                        break
+                    ops.pop(0)
+                    written += 1
+                if ops:
+                    retry[entry_id] = ops
+            with self._cond:
+                # Operations that failed go back in front of newer ones
+                newer, self._pending = self._pending, retry
+                for entry_id, ops in newer.items():
+                    for op, data in ops:
+                        self._coalesce(op, entry_id, data)
+                self.written += written
+                self.failures = self.failures + 1 if failed else 0
+                self._compact()
+            return written
+
+    def stats(self):
+        """ Counters of queued, coalesced, written and dropped operations """
+        return {
+            'pending': self.pending,
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+    def close(self, flush=True):
+        """ Stop the background thread, sending pending writes first when `flush` """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if flush:
+            self.flush()
+        with self._cond:
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Internal methods
+
+    def _enqueue(self, op, entry_id, data=None):
+        record = json.dumps({'op': op, 'entry_id': entry_id, 'data': data})
+        with self._cond:
+            if self._closed:
+                raise ValueError('WriteBehindQueue is closed.')
+            self._journal.write(record + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self.enqueued += 1
+            self._coalesce(op, entry_id, data)
+            if sum(len(ops) for ops in self._pending.values()) >= self.max_pending:
+                self._cond.notify_all()
+
+    def _coalesce(self, op, entry_id, data):
+        """ Add an operation to the pending ones (call with the lock held) """
+        ops = self._pending.setdefault(entry_id, [])
+        if ops and ops[-1][0] == TIMER and op == TOGGLE:
+            self.coalesced += 1
+            ops[-1] = (TIMER, {'running': not ops[-1][1]['running']})
+            return
+        if ops and ops[-1][0] == op:
+            self.coalesced += 1
+            if op == UPDATE:
+                ops[-1] = (UPDATE, _merge(ops[-1][1], data))
+            elif op == TIMER:
+                ops[-1] = (TIMER, data)
+            else:
+                ops.pop()
+                if not ops:
+                    del self._pending[entry_id]
+            return
+        ops.append((op, data))
+
+    def _send(self, op, entry_id, data):
+        """ Send one operation; False when it should be retried later """
+        if op != UPDATE:
+            running = self._timer_running(entry_id)
+            if running is None:
+                return False
+            if running is _GONE:
+                self.dropped += 1
+                return True
+            if running == data['running']:
+                # An earlier attempt got through
+                return True
+        if op == UPDATE:
+            resp = self._call('POST', '/daily/update/{0}'.format(entry_id), data)
+        else:
+            resp = self._call('GET', '/daily/timer/{0}'.format(entry_id))
+        if resp is None:
+            return False
+        if resp.status_code >= 400:
+            # The API refused the write (e.g. deleted entry); retrying will not help
+            self.last_error = resp
+            self.dropped += 1
+        return True
+
+    def _timer_running(self, entry_id):
+        """
+        Whether the entry's timer runs, None when that cannot be told now and
+        _GONE when the API refuses to show the entry
+        """
+        resp = self._call('GET', '/daily/show/{0}'.format(entry_id))
+        if resp is None:
+            return None
+        if resp.status_code >= 400:
+            self.last_error = resp
+            return _GONE
+        try:
+            body = resp.json()
+        except ValueError:
+            body = None
+        entry = body.get('day_entry', body) if isinstance(body, dict) else None
+        if not entry or 'id' not in entry:
+            self.last_error = resp
+            return None
+        return bool(entry.get('timer_started_at'))
+
+    def _call(self, method, path, data=None):
+        """ Response of a request, None when it failed and should be retried later """
+        try:
+            resp = self.client._request(method, path, data, PRIORITY_INTERACTIVE, raw=True)
+        except Exception as exc:
+            self.last_error = exc
+            return None
+        if resp.status_code >= 500:
+            self.last_error = resp
+            return None
+        return resp
+
+    def _compact(self, in_flight=None):
+        """
+        Rewrite the journal with the operations still to send: those of the
+        flush `in_flight`, if any, then the pending ones (call with the lock held)
+        """
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            for batch in (in_flight or {}, self._pending):
+                for entry_id, ops in batch.items():
+                    for op, data in ops:
+                        handle.write(json.dumps({'op': op, 'entry_id': entry_id, 'data': data}) + '\n')
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.rename(tmp_path, self.journal_path)
+        self._journal.close()
+        self._journal = open(self.journal_path, 'a')
+
+    def _replay(self):
+        """ Load the operations left in the journal by a previous run """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-write
+                    continue
+                self._coalesce(record['op'], record['entry_id'], record['data'])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self.failures:
+                    # The API is failing: pause however much is pending
+                    self._sleep(min(self.interval * 2 ** (self.failures - 1), self.max_backoff))
+                elif sum(len(ops) for ops in self._pending.values()) < self.max_pending:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _sleep(self, delay):
+        """ Wait `delay` seconds unless closed meanwhile (call with the lock held) """
+        deadline = time.time() + delay
+        while not self._closed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            self._cond.wait(remaining)
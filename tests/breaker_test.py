@@ -0,0 +1,105 @@
+import os, sys
+import threading
+import unittest
+from time import time
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest.breaker import CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = harvest.CircuitBreaker(window=10, min_calls=4, failure_rate=0.5,
+                                              slow_call=2.0, reset_timeout=30, clock=self.clock)
+
+    def test_trips_on_error_rate(self):
+        for failed in (False, True, False, False):
+            self.breaker.allow()
+            self.breaker.record(0.1, failed=failed)
+        self.assertEqual(CLOSED, self.breaker.state)
+        for _ in range(2):
+            self.breaker.allow()
+            self.breaker.record(0.1, failed=True)
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertRaises(harvest.CircuitOpenError, self.breaker.allow)
+        self.assertEqual(30, self.breaker.retry_after())
+
+    def test_trips_on_latency(self):
+        for _ in range(4):
+            self.breaker.record(5.0)
+        self.assertTrue(self.breaker.is_open)
+
+    def test_half_open_trial(self):
+        for _ in range(4):
+            self.breaker.record(0.1, failed=True)
+        self.clock.now += 31
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.breaker.allow()
+        # Only one trial call at a time
+        self.assertRaises(harvest.CircuitOpenError, self.breaker.allow)
+        self.breaker.record(0.1)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_half_open_failure_reopens(self):
+        for _ in range(4):
+            self.breaker.record(0.1, failed=True)
+        self.clock.now += 31
+        self.breaker.allow()
+        self.breaker.record(0.1, failed=True)
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_probe_keeps_circuit_open(self):
+        healthy = []
+        self.breaker.probe = lambda: bool(healthy)
+        for _ in range(4):
+            self.breaker.record(0.1, failed=True)
+        self.clock.now += 31
+        self.assertEqual(OPEN, self.breaker.state)
+        healthy.append(True)
+        self.clock.now += 31
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+
+    def test_slow_probe_does_not_block_callers(self):
+        started, release = threading.Event(), threading.Event()
+        def probe():
+            started.set()
+            release.wait(5)
+            return True
+        self.breaker.probe = probe
+        for _ in range(4):
+            self.breaker.record(0.1, failed=True)
+        self.clock.now += 31
+        prober = threading.Thread(target=lambda: self.breaker.state)
+        prober.start()
+        started.wait(5)
+        begin = time()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertRaises(harvest.CircuitOpenError, self.breaker.allow)
+        self.assertEqual('open', self.breaker.stats()['state'])
+        self.assertTrue(time() - begin < 1)
+        release.set()
+        prober.join()
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+
+    def test_client_fails_fast(self):
+        client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                 breaker=self.breaker)
+        for _ in range(4):
+            self.breaker.record(0.1, failed=True)
+        self.assertIs(self.breaker, client.breaker)
+        self.assertRaises(harvest.CircuitOpenError, client.get_project, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os, sys
+import threading
+import unittest
+from time import time
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from stubs import StubTransport
+
+LATENCY = 0.02
+
+
+class SlowTransport(StubTransport):
+    """ Echoes the request path and credentials, noting the session of each thread """
+    def __init__(self):
+        super(SlowTransport, self).__init__(latency=LATENCY)
+        self.sessions = set()
+
+    def body(self, path, requestor, kwargs):
+        with self.lock:
+            self.sessions.add((threading.current_thread().ident, id(requestor)))
+        return {'path': path, 'auth': kwargs['headers']['Authorization']}
+
+
+class TestSharedClient(unittest.TestCase):
+    def setUp(self):
+        self.transport = SlowTransport()
+        self.client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                      transport=self.transport)
+        self.errors = []
+
+    def hammer(self, threads, calls):
+        def work(offset):
+            try:
+                for i in range(calls):
+                    project_id = offset * calls + i
+                    resp = self.client.get_project(project_id)
+                    if resp['path'] != '/projects/{0}'.format(project_id):
+                        self.errors.append(resp)
+            except Exception as exc:
+                self.errors.append(exc)
+
+        workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+        start = time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return threads * calls / (time() - start)
+
+    def test_throughput_scales_with_threads(self):
+        single = self.hammer(1, 16)
+        many = self.hammer(8, 16)
+        self.assertEqual([], self.errors)
+        self.assertTrue(many > 4 * single, (single, many))
+
+    def test_one_session_per_thread(self):
+        self.hammer(4, 3)
+        self.assertEqual([], self.errors)
+        threads = set(thread for thread, _ in self.transport.sessions)
+        sessions = set(session for _, session in self.transport.sessions)
+        self.assertEqual(len(threads), len(self.transport.sessions))
+        self.assertEqual(len(threads), len(sessions))
+
+    def test_request_defaults_are_immutable(self):
+        headers = self.client.headers
+        headers['Authorization'] = 'tampered'
+        self.assertNotEqual('tampered', self.client.get_project(1)['auth'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os, sys
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest.diffing import diff_payload
+from harvest.transport import make_response
+
+
+class StubClient(object):
+    def __init__(self, records, status=200):
+        self.records = records
+        self.status = status
+        self.puts = []
+
+    def _get(self, path):
+        return self.records[path]
+
+    def _put(self, path, data=None, raw=False):
+        self.puts.append((path, data))
+        body = '{}' if self.status < 400 else '{"message": "Validation failed"}'
+        return make_response(self.status, body, path)
+
+    _decode = staticmethod(harvest.Harvest._decode)
+
+
+class TestWriteDiffer(unittest.TestCase):
+    def setUp(self):
+        self.client = StubClient({
+            '/projects/1': {'project': {'id': 1, 'name': 'Alpha', 'budget': 10.0, 'active': True}},
+        })
+        self.differ = harvest.WriteDiffer()
+
+    def test_diff_payload(self):
+        known = {'project': {'id': 1, 'name': 'Alpha', 'client_id': 7}}
+        self.assertEqual({}, diff_payload(known, {'project': {'name': 'Alpha', 'client_id': '7'}}))
+        self.assertEqual({'project': {'name': 'Beta'}},
+                         diff_payload(known, {'project': {'name': 'Beta', 'client_id': 7}}))
+        self.assertEqual(None, diff_payload(known, {'client': {'name': 'Beta'}}))
+
+    def test_diff_payload_utf8_bytes(self):
+        known = {'project': {'name': u'caf\xe9', 'notes': None}}
+        self.assertEqual({}, diff_payload(known, {'project': {'name': 'caf\xc3\xa9'}}))
+        self.assertEqual({'project': {'name': 'th\xc3\xa9', 'notes': 'None'}},
+                         diff_payload(known, {'project': {'name': 'th\xc3\xa9', 'notes': 'None'}}))
+
+    def test_skips_unchanged_write(self):
+        self.differ.put(self.client, '/projects/1', {'project': {'name': 'Alpha', 'budget': 10}})
+        self.assertEqual([], self.client.puts)
+        self.assertEqual(1, self.differ.stats()['skipped'])
+
+    def test_sends_changed_fields_only(self):
+        self.differ.put(self.client, '/projects/1', {'project': {'name': 'Beta', 'budget': 10}})
+        self.assertEqual([('/projects/1', {'project': {'name': 'Beta'}})], self.client.puts)
+        # The cache follows the write, so repeating it is a no-op
+        self.differ.put(self.client, '/projects/1', {'project': {'name': 'Beta', 'budget': 10}})
+        self.assertEqual(1, len(self.client.puts))
+        self.assertEqual({'sent': 1, 'skipped': 1, 'fetched': 1, 'fields_sent': 1}, self.differ.stats())
+
+    def test_rejected_write_is_not_cached(self):
+        self.client.status = 422
+        payload = {'project': {'name': 'Beta'}}
+        self.assertEqual({'message': 'Validation failed'},
+                         self.differ.put(self.client, '/projects/1', payload))
+        self.client.status = 200
+        self.differ.put(self.client, '/projects/1', payload)
+        self.assertEqual(2, len(self.client.puts))
+        self.assertEqual(0, self.differ.stats()['skipped'])
+
+    def test_full_payload_when_partial_unsupported(self):
+        differ = harvest.WriteDiffer(partial=())
+        payload = {'project': {'name': 'Beta', 'budget': 10}}
+        differ.put(self.client, '/projects/1', payload)
+        self.assertEqual([('/projects/1', payload)], self.client.puts)
+
+    def test_prime_avoids_fetch(self):
+        differ = harvest.WriteDiffer(fetch=False)
+        differ.prime('/projects/{0}', [{'project': {'id': 2, 'name': 'Gamma'}}])
+        differ.put(self.client, '/projects/2', {'project': {'name': 'Gamma'}})
+        self.assertEqual({'sent': 0, 'skipped': 1, 'fetched': 0, 'fields_sent': 0}, differ.stats())
+
+    def test_stale_record_is_refetched(self):
+        now = [0.0]
+        differ = harvest.WriteDiffer(max_age=60, clock=lambda: now[0])
+        payload = {'project': {'name': 'Alpha'}}
+        differ.put(self.client, '/projects/1', payload)
+        # Renamed in the web UI meanwhile
+        self.client.records['/projects/1'] = {'project': {'id': 1, 'name': 'Renamed'}}
+        now[0] = 30.0
+        differ.put(self.client, '/projects/1', payload)
+        self.assertEqual([], self.client.puts)
+        now[0] = 61.0
+        differ.put(self.client, '/projects/1', payload)
+        self.assertEqual([('/projects/1', payload)], self.client.puts)
+        self.assertEqual({'sent': 1, 'skipped': 2, 'fetched': 2, 'fields_sent': 1}, differ.stats())
+
+    def test_stale_record_without_fetch_sends_everything(self):
+        now = [0.0]
+        differ = harvest.WriteDiffer(fetch=False, max_age=60, clock=lambda: now[0])
+        differ.prime('/projects/{0}', [{'project': {'id': 1, 'name': 'Alpha', 'budget': 10}}])
+        now[0] = 61.0
+        payload = {'project': {'name': 'Alpha', 'budget': 10}}
+        differ.put(self.client, '/projects/1', payload)
+        self.assertEqual([('/projects/1', payload)], self.client.puts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os, sys
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+
+HEADER = u"kind,description,quantity,unit_price,amount,taxed,taxed2,project_id\n"
+
+
+class TestLineItems(unittest.TestCase):
+    def setUp(self):
+        self.invoices = [
+            {'invoice': {'id': 11, 'csv_line_items': HEADER +
+                         u"Service,Web development,10.00,100.00,1000.0,false,false,5\n"
+                         u"Product,\"Caf\xe9 mugs,\nboxed\",2,7.5,15.0,false,false,\n"}},
+            {'invoice': {'id': 12, 'csv_line_items': u''}},
+            {'invoice': {'id': 13, 'csv_line_items': u"kind,amount,quantity\nService,250,\n"}},
+        ]
+
+    def test_columns(self):
+        items = harvest.extract_line_items(self.invoices)
+        self.assertEqual(3, len(items))
+        self.assertEqual([11, 11, 13], list(items.invoice_id))
+        self.assertEqual([u'Service', u'Product', u'Service'], items.kind)
+        self.assertEqual(u'Caf\xe9 mugs,\nboxed', items.description[1])
+        self.assertEqual(u'', items.description[2])
+        self.assertEqual([10.0, 2.0, 0.0], list(items.quantity))
+        self.assertEqual([100.0, 7.5, 0.0], list(items.unit_price))
+
+    def test_rollups(self):
+        items = harvest.extract_line_items(self.invoices)
+        self.assertEqual(1265.0, items.total())
+        self.assertEqual({u'Service': 1250.0, u'Product': 15.0}, items.totals_by('kind'))
+        self.assertEqual({11: 1015.0, 13: 250.0}, items.totals_by('invoice_id'))
+        self.assertEqual((11, u'Service', u'Web development', 10.0, 100.0, 1000.0),
+                         list(items.rows())[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os, sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest.merge import entry_sort_key
+
+
+def entry(entry_id, spent_at, user_id, project_id=1):
+    return {'day_entry': {'id': entry_id, 'spent_at': spent_at, 'user_id': user_id,
+                          'project_id': project_id}}
+
+
+class StubClient(object):
+    def __init__(self, entries):
+        self.entries = entries
+
+    def timesheets_for_project(self, project_id, start_date, end_date, stream=False):
+        return iter(e for e in self.entries if e['day_entry']['project_id'] == project_id)
+
+
+class TestExternalSorter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rand = random.Random(7)
+        self.entries = [
+            entry(i, u'2016-01-{0:02d}'.format(rand.randint(1, 28)), rand.randint(1, 5),
+                  project_id=rand.randint(1, 4))
+            for i in range(500)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_in_memory(self):
+        sorter = harvest.ExternalSorter(max_records=1000)
+        sorter.extend(self.entries)
+        self.assertEqual(sorted(self.entries, key=entry_sort_key), list(sorter))
+        self.assertEqual(0, sorter.spilled)
+
+    def test_spills_and_merges_in_passes(self):
+        sorter = harvest.ExternalSorter(max_records=16, fan_in=4, tmpdir=self.tmpdir)
+        sorter.extend(self.entries)
+        self.assertEqual(sorted(self.entries, key=entry_sort_key), list(sorter))
+        self.assertEqual(500, sorter.spilled)
+
+    def test_merge_timesheets(self):
+        client = StubClient(self.entries)
+        merged = list(harvest.merge_timesheets(client, [1, 2, 3, 4], '2016-01-01', '2016-01-31',
+                                               max_records=50, tmpdir=self.tmpdir))
+        self.assertEqual(sorted(self.entries, key=entry_sort_key), merged)
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os, sys
+import threading
+import traceback
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from stubs import StubTransport
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_waits_for_refill(self):
+        now = [0.0]
+        slept = []
+
+        def sleep(delay):
+            slept.append(delay)
+            now[0] += delay
+
+        bucket = harvest.TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertEqual(0.5, bucket.acquire())
+        self.assertEqual([0.5], slept)
+
+
+class TestHarvestPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = harvest.HarvestPool(workers=1, max_per_account=1)
+        for name in ('big', 'small'):
+            self.pool.add_account(name, "https://{0}.harvestapp.com".format(name),
+                                  email="tester@example.com", password="secret",
+                                  transport=StubTransport())
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_round_robin_between_accounts(self):
+        order = []
+        gate = threading.Event()
+
+        def job(client, name):
+            gate.wait(5)
+            order.append(name)
+
+        for _ in range(3):
+            self.pool.submit('big', job, 'big')
+        last = self.pool.submit('small', job, 'small')
+        gate.set()
+        last.result(5)
+        self.pool.close()
+        self.assertEqual(['big', 'small', 'big', 'big'], order)
+
+    def test_shared_adapter(self):
+        url = "https://api.harvestapp.com"
+        one = self.pool.add_account('one', url, email="one@example.com", password="secret")
+        two = self.pool.add_account('two', url, email="two@example.com", password="secret")
+        adapter = one._session().get_adapter(url)
+        self.assertIs(adapter, two._session().get_adapter(url))
+        self.assertIsNot(adapter, self.pool.client('big')._session().get_adapter(url))
+
+    def test_stats_and_errors(self):
+        job = self.pool.submit('small', harvest.Harvest.projects)
+        self.assertEqual([], job.result(5))
+        def fail(client):
+            return 1 / 0
+        try:
+            self.pool.submit('big', fail).result(5)
+            self.fail('ZeroDivisionError not raised')
+        except ZeroDivisionError:
+            # The worker's traceback survives the re-raise
+            self.assertEqual('fail', traceback.extract_tb(sys.exc_info()[2])[-1][2])
+        stats = self.pool.stats()
+        self.assertEqual(1, stats['small']['requests'])
+        self.assertEqual(1, stats['small']['jobs_completed'])
+        self.assertEqual(1, stats['big']['jobs_failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os, sys
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest.watch import WatchEvent, ADDED, CHANGED, REMOVED
+
+
+def entry(entry_id, hours, spent_at, project_id=1, user_id=10, task_id=100, billable=True,
+          updated_at='2016-01-04T10:00:00Z'):
+    return {'day_entry': {'id': entry_id, 'hours': hours, 'spent_at': spent_at,
+                          'project_id': project_id, 'user_id': user_id, 'task_id': task_id,
+                          'billable': billable, 'updated_at': updated_at}}
+
+
+def expense(expense_id, total_cost, spent_at, project_id=1, user_id=10):
+    return {'expense': {'id': expense_id, 'total_cost': total_cost, 'spent_at': spent_at,
+                        'project_id': project_id, 'user_id': user_id,
+                        'updated_at': '2016-01-04T10:00:00Z'}}
+
+
+class StubClient(object):
+    """ Serves entries and expenses, recording the updated_since of each call """
+    def __init__(self, entries, expenses=()):
+        self.entries = list(entries)
+        self.expenses = list(expenses)
+        self.since = []
+
+    def _select(self, records, kind, project_id, updated_since):
+        self.since.append(updated_since)
+        return iter(r for r in records if r[kind]['project_id'] == project_id
+                    and (updated_since is None or r[kind]['updated_at'] > updated_since))
+
+    def timesheets_for_project(self, project_id, start_date, end_date, updated_since=None, stream=False):
+        return self._select(self.entries, 'day_entry', project_id, updated_since)
+
+    def expenses_for_project(self, project_id, start_date, end_date, updated_since=None, stream=False):
+        return self._select(self.expenses, 'expense', project_id, updated_since)
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self):
+        self.rollups = harvest.Rollups(project_clients={1: 7, 2: 7, 3: 8})
+        self.rollups.extend([
+            entry(1, 2.0, '2016-01-04'),
+            entry(2, 1.5, '2016-01-05', user_id=11, billable=False),
+            entry(3, 4.0, '2016-02-01', project_id=3, task_id=101),
+            expense(1, '25.50', '2016-01-04'),
+        ])
+
+    def test_totals(self):
+        self.assertEqual((7.5, 6.0, 25.5), self.rollups.total())
+        self.assertEqual((3.5, 2.0, 25.5), self.rollups.total('project', 1))
+        self.assertEqual((3.5, 2.0, 25.5), self.rollups.total('client', 7))
+        self.assertEqual((1.5, 0.0, 0.0), self.rollups.total('user', 11))
+        self.assertEqual((4.0, 4.0, 0.0), self.rollups.total('task', 101))
+        self.assertEqual(harvest.rollups.ZERO, self.rollups.total('project', 99))
+
+    def test_buckets(self):
+        self.assertEqual((2.0, 2.0, 25.5), self.rollups.total('project', 1, 'day', '2016-01-04'))
+        self.assertEqual((3.5, 2.0, 25.5), self.rollups.total('project', 1, 'week', '2016-W01'))
+        self.assertEqual((4.0, 4.0, 0.0), self.rollups.total(bucket='month', period='2016-02'))
+        self.assertEqual(set(['2016-01', '2016-02']), set(self.rollups.series('user', 10, 'month')))
+
+    def test_breakdown(self):
+        breakdown = self.rollups.breakdown('client', 'month', '2016-01')
+        self.assertEqual({7: (3.5, 2.0, 25.5)}, breakdown)
+        self.assertEqual(set([1, 3]), set(self.rollups.breakdown('project')))
+
+    def test_changed_entry_replaces_its_contribution(self):
+        self.rollups.apply(entry(1, 3.0, '2016-01-11', project_id=2))
+        self.assertEqual((1.5, 0.0, 25.5), self.rollups.total('project', 1))
+        self.assertEqual((3.0, 3.0, 0.0), self.rollups.total('project', 2))
+        self.assertEqual((8.5, 7.0, 25.5), self.rollups.total())
+        self.assertEqual((0.0, 0.0, 25.5), self.rollups.total(bucket='day', period='2016-01-04'))
+        self.assertNotIn('2016-01-04', self.rollups.series('task', 100, 'day'))
+
+    def test_remove(self):
+        self.rollups.remove(entry(3, 4.0, '2016-02-01'))
+        self.rollups.remove(expense(1, 0, '2016-01-04'))
+        self.assertEqual((3.5, 2.0, 0.0), self.rollups.total())
+        self.assertEqual({}, self.rollups.breakdown('project', 'month', '2016-02'))
+        self.assertEqual(2, len(self.rollups))
+
+    def test_watch_events(self):
+        # /daily reports ids as strings and entries without a wrapper
+        daily = {'id': '4', 'hours': '0.5', 'spent_at': '2016-01-04', 'project_id': '1',
+                 'user_id': '10', 'task_id': '100', 'billable': True}
+        self.rollups.on_event(WatchEvent(ADDED, daily))
+        self.assertEqual((4.0, 2.5, 25.5), self.rollups.total('project', 1))
+        self.rollups.on_event(WatchEvent(CHANGED, dict(daily, hours='1.0')))
+        self.assertEqual((4.5, 3.0, 25.5), self.rollups.total('project', '1'))
+        self.rollups.on_event(WatchEvent(REMOVED, daily))
+        self.assertEqual((3.5, 2.0, 25.5), self.rollups.total('project', 1))
+
+    def test_day_rollover_keeps_yesterday(self):
+        class Daily(object):
+            days = [('2016-01-04', [{'id': 5, 'hours': 8.0, 'spent_at': '2016-01-04',
+                                     'project_id': 1, 'updated_at': 't1'}]),
+                    ('2016-01-05', [])]
+
+            @property
+            def today(self):
+                # The poller thread may fetch too: the last day is served again
+                for_day, entries = self.days.pop(0) if len(self.days) > 1 else self.days[0]
+                return {'for_day': for_day, 'day_entries': entries}
+
+        rollups = harvest.Rollups()
+        watcher = harvest.DailyWatcher(Daily(), min_interval=3600, max_interval=3600)
+        watcher.poll()
+        subscription = watcher.subscribe(rollups.on_event)
+        self.assertEqual((8.0, 0.0, 0.0), rollups.total(bucket='day', period='2016-01-04'))
+        self.assertEqual([], watcher.poll())
+        subscription.cancel()
+        self.assertEqual((8.0, 0.0, 0.0), rollups.total(bucket='day', period='2016-01-04'))
+
+    def test_events_do_not_move_the_refresh_watermark(self):
+        client = StubClient([entry(1, 2.0, '2016-01-04', updated_at='2016-01-04T10:00:00Z')])
+        rollups = harvest.Rollups()
+        rollups.refresh(client, [1], '2016-01-01', '2016-01-31')
+        daily = {'id': 9, 'hours': 1.0, 'spent_at': '2016-01-05', 'project_id': 1,
+                 'updated_at': '2016-01-05T12:00:00Z'}
+        rollups.on_event(WatchEvent(ADDED, daily))
+        # Someone else's change made before the watched one
+        client.entries.append(entry(2, 3.0, '2016-01-05', updated_at='2016-01-05T11:00:00Z'))
+        self.assertEqual(1, rollups.refresh(client, [1], '2016-01-01', '2016-01-31', expenses=False))
+        self.assertEqual(6.0, rollups.total().hours)
+
+    def test_refresh_fetches_changes_only(self):
+        entries = [entry(1, 2.0, '2016-01-04'), entry(2, 1.0, '2016-01-05', project_id=2)]
+        client = StubClient(entries, [expense(1, 10, '2016-01-04')])
+        rollups = harvest.Rollups()
+        self.assertEqual(3, rollups.refresh(client, [1, 2], '2016-01-01', '2016-01-31'))
+        self.assertEqual((3.0, 3.0, 10.0), rollups.total())
+
+        client.entries[0] = entry(1, 5.0, '2016-01-04', updated_at='2016-01-05T09:00:00Z')
+        self.assertEqual(1, rollups.refresh(client, [1, 2], '2016-01-01', '2016-01-31'))
+        self.assertEqual((6.0, 6.0, 10.0), rollups.total())
+        # Project 2 has no expenses, so those are still fetched in full
+        self.assertEqual(['2016-01-04T10:00:00Z'] * 3 + [None], client.since[-4:])
+        self.assertEqual('2016-01-05T09:00:00Z', rollups.updated_at)
+
+    def test_added_project_is_loaded_in_full(self):
+        entries = [entry(1, 2.0, '2016-01-04', updated_at='2016-01-05T09:00:00Z'),
+                   entry(2, 1.0, '2016-01-04', project_id=2, updated_at='2016-01-04T08:00:00Z')]
+        client = StubClient(entries)
+        rollups = harvest.Rollups()
+        self.assertEqual(1, rollups.refresh(client, [1], '2016-01-01', '2016-01-31', expenses=False))
+        # Project 2 changed before project 1's watermark
+        self.assertEqual(1, rollups.refresh(client, [1, 2], '2016-01-01', '2016-01-31', expenses=False))
+        self.assertEqual(3.0, rollups.total().hours)
+        # So is a new window of a project already refreshed
+        self.assertEqual(1, rollups.refresh(client, [2], '2016-01-01', '2016-03-31', expenses=False))
+        self.assertEqual([None, '2016-01-05T09:00:00Z', None, None], client.since)
+
+
+if __name__ == '__main__':
+    unittest.main()
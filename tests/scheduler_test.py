@@ -0,0 +1,107 @@
+import os, sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH
+from stubs import StubTransport
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def wait_queued(self, scheduler, priority, depth):
+        for _ in range(500):
+            if scheduler.metrics()[priority]['queued'] == depth:
+                return
+            time.sleep(0.01)
+        self.fail('queue never reached depth {0}'.format(depth))
+
+    def test_interactive_jumps_the_queue(self):
+        scheduler = harvest.RequestScheduler(max_concurrency=1)
+        order = []
+
+        def call(priority, name):
+            scheduler.acquire(priority)
+            order.append(name)
+            scheduler.release(priority)
+
+        scheduler.acquire(PRIORITY_BATCH)
+        threads = [threading.Thread(target=call, args=(PRIORITY_BATCH, 'batch'))]
+        threads[0].start()
+        self.wait_queued(scheduler, PRIORITY_BATCH, 1)
+        threads.append(threading.Thread(target=call, args=(PRIORITY_INTERACTIVE, 'interactive')))
+        threads[1].start()
+        self.wait_queued(scheduler, PRIORITY_INTERACTIVE, 1)
+        scheduler.release(PRIORITY_BATCH)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(['interactive', 'batch'], order)
+        self.assertEqual(2, scheduler.metrics()[PRIORITY_BATCH]['requests'])
+        self.assertEqual(1, scheduler.metrics()[PRIORITY_BATCH]['max_queued'])
+
+    def test_batch_keeps_headroom(self):
+        scheduler = harvest.RequestScheduler(max_concurrency=4, batch_share=0.5)
+        scheduler.acquire(PRIORITY_BATCH)
+        scheduler.acquire(PRIORITY_BATCH)
+        thread = threading.Thread(target=scheduler.acquire, args=(PRIORITY_BATCH,))
+        thread.daemon = True
+        thread.start()
+        self.wait_queued(scheduler, PRIORITY_BATCH, 1)
+        # Interactive calls still get through while batch is at its share
+        scheduler.acquire(PRIORITY_INTERACTIVE)
+        self.assertEqual(1, scheduler.metrics()[PRIORITY_INTERACTIVE]['running'])
+        scheduler.release(PRIORITY_BATCH)
+        thread.join(5)
+        self.assertEqual(2, scheduler.metrics()[PRIORITY_BATCH]['running'])
+
+    def test_interactive_gets_the_next_token(self):
+        scheduler = harvest.RequestScheduler(max_concurrency=4)
+        limiter = harvest.TokenBucket(rate=2, capacity=1)
+        limiter.acquire()
+        order = []
+
+        def call(priority, name):
+            scheduler.acquire(priority, limiter)
+            order.append(name)
+            scheduler.release(priority)
+
+        threads = [threading.Thread(target=call, args=(PRIORITY_BATCH, 'batch'))]
+        threads[0].start()
+        self.wait_queued(scheduler, PRIORITY_BATCH, 1)
+        # Throttled requests wait without a slot
+        self.assertEqual(0, scheduler.metrics()[PRIORITY_BATCH]['running'])
+        threads.append(threading.Thread(target=call, args=(PRIORITY_INTERACTIVE, 'interactive')))
+        threads[1].start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(['interactive', 'batch'], order)
+
+    def test_batch_throttling_is_queue_time(self):
+        scheduler = harvest.RequestScheduler(batch_rate=4, batch_burst=1)
+        for _ in range(2):
+            scheduler.acquire(PRIORITY_BATCH)
+            scheduler.release(PRIORITY_BATCH)
+        metrics = scheduler.metrics()[PRIORITY_BATCH]
+        self.assertTrue(metrics['max_wait'] >= 0.2, metrics)
+        self.assertEqual(1, metrics['max_queued'])
+
+    def test_client_tags_calls(self):
+        scheduler = harvest.RequestScheduler()
+        client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                 transport=StubTransport(), scheduler=scheduler)
+        client.today
+        client.timesheets_for_project(1, '2016-01-01', '2016-12-31')
+        client.projects()
+        with client.priority(PRIORITY_BATCH):
+            client.get_day(1, 2016)
+        metrics = scheduler.metrics()
+        self.assertEqual(1, metrics[PRIORITY_INTERACTIVE]['requests'])
+        self.assertEqual(1, metrics[PRIORITY_NORMAL]['requests'])
+        self.assertEqual(2, metrics[PRIORITY_BATCH]['requests'])
+        self.assertEqual(0, metrics[PRIORITY_BATCH]['running'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os, sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+
+
+class StubClient(object):
+    def __init__(self, suffix=''):
+        self.suffix = suffix
+
+    def projects(self):
+        return [{'project': {'id': i, 'name': 'Project {0}{1}'.format(i, self.suffix)}}
+                for i in range(1, 200)]
+
+    def clients(self):
+        return [{'client': {'id': 42, 'name': u'Caf\xe9'}}]
+
+    def people(self):
+        return [{'user': {'id': 7, 'email': 'tester@example.com'}}]
+
+    def tasks(self):
+        return []
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'reference.snap')
+        harvest.publish_snapshot(StubClient(), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup_by_id(self):
+        with harvest.Snapshot(self.path) as snapshot:
+            self.assertEqual(['clients', 'people', 'projects', 'tasks'], snapshot.datasets)
+            self.assertEqual(199, snapshot.count('projects'))
+            self.assertEqual({'project': {'id': 150, 'name': 'Project 150'}},
+                             snapshot.get('projects', 150))
+            self.assertEqual(u'Caf\xe9', snapshot.get('clients', 42)['client']['name'])
+            self.assertEqual(None, snapshot.get('projects', 1000))
+            self.assertEqual(None, snapshot.get('tasks', 1))
+            self.assertEqual(1, len(list(snapshot.records('people'))))
+
+    def test_atomic_swap(self):
+        snapshot = harvest.Snapshot(self.path)
+        old = snapshot.get_raw('projects', 3)
+        harvest.publish_snapshot(StubClient(' v2'), self.path)
+        self.assertTrue(snapshot.reload())
+        self.assertEqual('Project 3 v2', snapshot.get('projects', 3)['project']['name'])
+        # Buffers taken before the swap still read the old snapshot
+        self.assertIn('Project 3"', str(old))
+        self.assertFalse(snapshot.reload())
+        self.assertEqual(['reference.snap'], os.listdir(self.tmpdir))
+
+    def test_string_ids(self):
+        with harvest.Snapshot(self.path) as snapshot:
+            self.assertEqual('Project 150', snapshot.get('projects', '150')['project']['name'])
+            self.assertEqual(None, snapshot.get('projects', 'abc'))
+            self.assertEqual(None, snapshot.get_raw('projects', None))
+
+    def test_duplicate_ids_keep_the_last_record(self):
+        harvest.write_snapshot(self.path, {'clients': [
+            {'client': {'id': 1, 'name': 'Old'}},
+            {'client': {'id': '2', 'name': 'Other'}},
+            {'client': {'id': 1, 'name': 'New'}},
+        ]})
+        with harvest.Snapshot(self.path) as snapshot:
+            self.assertEqual(2, snapshot.count('clients'))
+            self.assertEqual('New', snapshot.get('clients', 1)['client']['name'])
+            self.assertEqual(2, len(list(snapshot.records('clients'))))
+
+    def test_records_and_count_follow_a_new_snapshot(self):
+        snapshot = harvest.Snapshot(self.path, check_interval=0)
+        harvest.write_snapshot(self.path, {'projects': [{'project': {'id': 1, 'name': 'Only'}}]})
+        self.assertEqual(1, snapshot.count('projects'))
+        harvest.write_snapshot(self.path, {'projects': [{'project': {'id': 2, 'name': 'Next'}}]})
+        self.assertEqual([{'project': {'id': 2, 'name': 'Next'}}], list(snapshot.records('projects')))
+        snapshot.close()
+
+    def test_rejects_other_files(self):
+        other = os.path.join(self.tmpdir, 'other')
+        with open(other, 'wb') as handle:
+            handle.write(b'not a snapshot')
+        self.assertRaises(harvest.HarvestError, harvest.Snapshot, other)
+
+
+if __name__ == '__main__':
+    unittest.main()
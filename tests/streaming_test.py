@@ -0,0 +1,102 @@
+import os, sys
+import json
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from stubs import StubTransport
+
+RECORDS = [
+    {'day_entry': {'id': 1, 'notes': u'brackets ] } and "quotes" \\ caf\xe9', 'hours': 1.5}},
+    {'day_entry': {'id': 2, 'notes': None, 'tags': [1, [2, {}]]}},
+    [],
+    u'text, with comma',
+    42,
+    None,
+]
+
+
+def chunked(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def test_any_chunking(self):
+        body = json.dumps(RECORDS, indent=1).encode('utf-8')
+        for size in (1, 2, 3, 7, 64, len(body)):
+            self.assertEqual(RECORDS, list(harvest.iter_json_array(chunked(body, size))), size)
+
+    def test_records_before_body_ends(self):
+        parsed = harvest.iter_json_array(iter([b'[{"a": 1}, {"b"', b': 2}]']))
+        self.assertEqual({'a': 1}, next(parsed))
+
+    def test_empty_and_non_array_bodies(self):
+        self.assertEqual([], list(harvest.iter_json_array([b' [ ', b'] '])))
+        self.assertEqual([{'message': 'Authentication failed'}],
+                         list(harvest.iter_json_array([b'{"message": "Authen', b'tication failed"}'])))
+
+    def test_invalid_body(self):
+        self.assertRaises(ValueError, list, harvest.iter_json_array([b'[{"a": nope}]']))
+        for truncated in (b'[1, 2', b'[1, 2,', b'[{"a": 1}, {"b"', b'[{"a": 1}', b'['):
+            parsed = harvest.iter_json_array(chunked(truncated, 3))
+            self.assertRaises(ValueError, list, parsed)
+
+
+class TestStreamedEndpoints(unittest.TestCase):
+    def setUp(self):
+        self.transport = StubTransport({
+            '/projects/1/entries?from=2016-01-01&to=2016-12-31': RECORDS[:2],
+            '/invoices?page=1': [{'invoice': {'id': 1}}, {'invoice': {'id': 2}}],
+            '/invoices?page=2': [{'invoice': {'id': 3}}],
+        })
+        self.client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                      transport=self.transport)
+
+    def streamed(self):
+        return [kwargs.get('stream', False) for kwargs in self.transport.sent]
+
+    def test_timesheets_iterator(self):
+        entries = self.client.timesheets_for_project(1, '2016-01-01', '2016-12-31', stream=True)
+        self.assertFalse(isinstance(entries, list))
+        self.assertEqual(RECORDS[:2], list(entries))
+        self.assertEqual([True], self.streamed())
+
+    def test_invoice_pages(self):
+        invoices = self.client.invoices(stream=True)
+        self.assertEqual([1, 2, 3], [invoice['invoice']['id'] for invoice in invoices])
+        self.assertEqual(3, len(self.streamed()))
+
+    def test_streamed_call_holds_its_slot(self):
+        scheduler = harvest.RequestScheduler()
+        client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                 transport=self.transport, scheduler=scheduler)
+        running = lambda: scheduler.metrics()[harvest.PRIORITY_BATCH]['running']
+        entries = client.timesheets_for_project(1, '2016-01-01', '2016-12-31', stream=True)
+        self.assertEqual(1, running())
+        next(entries)
+        self.assertEqual(1, running())
+        self.assertEqual(RECORDS[1:2], list(entries))
+        self.assertEqual(0, running())
+        # Dropping an unread stream gives the slot back too
+        entries = client.timesheets_for_project(1, '2016-01-01', '2016-12-31', stream=True)
+        self.assertEqual(1, running())
+        del entries
+        self.assertEqual(0, running())
+
+    def test_error_status_raises_harvest_error(self):
+        self.transport.status = 401
+        self.transport.bodies['/invoices?page=1'] = {'message': 'Authentication failed'}
+        self.assertRaises(harvest.HarvestError, list, self.client.invoices(stream=True))
+        self.assertEqual(1, len(self.streamed()))
+        entries = self.client.timesheets_for_project(1, '2016-01-01', '2016-12-31', stream=True)
+        self.assertRaises(harvest.HarvestError, list, entries)
+
+    def test_invalid_body_raises_harvest_error(self):
+        client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                 transport=StubTransport(status=502, default='<html>Bad Gateway</html>'))
+        self.assertRaises(harvest.HarvestError, list, client.clients(stream=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+ Stand-ins shared by the test modules
+"""
+import os, sys
+import threading
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))+"/..")
+
+import harvest
+from harvest.transport import make_response
+
+JSON_HEADERS = {'Content-Type': 'application/json; charset=utf-8'}
+
+
+class StubTransport(harvest.Transport):
+    """
+    Network stand-in answering each path with a canned body (`default` for
+    unknown paths) after `latency` seconds; every request sent is kept in `sent`
+    """
+    def __init__(self, bodies=None, status=200, default='[]', latency=0):
+        self.bodies = bodies or {}
+        self.status = status
+        self.default = default
+        self.latency = latency
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def body(self, path, requestor, kwargs):
+        return self.bodies.get(path, self.default)
+
+    def send(self, requestor, **kwargs):
+        with self.lock:
+            self.sent.append(kwargs)
+        if self.latency:
+            sleep(self.latency)
+        path = kwargs['url'].split('harvestapp.com', 1)[1]
+        return make_response(self.status, self.body(path, requestor, kwargs), kwargs['url'],
+                             JSON_HEADERS, self.latency)
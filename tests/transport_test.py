@@ -0,0 +1,68 @@
+import os, sys
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from time import time
+from base64 import b64encode
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from stubs import StubTransport
+
+
+class TestRecordReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'traffic.jsonl.gz')
+        self.uri = "https://example.harvestapp.com"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def record(self):
+        canned = StubTransport(latency=0.05, bodies={
+            '/clients': [{'client': {'id': 1, 'name': u'Caf\xe9'}}],
+            '/projects/7': {'project': {'id': 7}},
+        })
+        with harvest.RecordingTransport(self.path, inner=canned) as recorder:
+            client = harvest.Harvest(self.uri, "tester@example.com", "secret", transport=recorder)
+            client.clients()
+            client.get_project(7)
+        return canned
+
+    def test_replay_without_network(self):
+        self.record()
+        client = harvest.Harvest(self.uri, "tester@example.com", "secret",
+                                 transport=harvest.ReplayTransport(self.path))
+        self.assertEqual([{'client': {'id': 1, 'name': u'Caf\xe9'}}], client.clients())
+        self.assertEqual({'project': {'id': 7}}, client.get_project(7))
+        # Unrecorded requests surface as client errors
+        self.assertRaises(harvest.HarvestError, client.get_project, 8)
+
+    def test_credentials_not_recorded(self):
+        self.record()
+        with gzip.open(self.path, 'rb') as handle:
+            text = handle.read().decode('utf-8')
+        records = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(2, len(records))
+        for record in records:
+            self.assertEqual(set(['method', 'url', 'data', 'status', 'headers', 'elapsed', 'body']),
+                             set(record))
+        token = b64encode(b'tester@example.com:secret').decode('ascii')
+        for secret in ('secret', token, 'Authorization'):
+            self.assertNotIn(secret, text)
+
+    def test_replay_at_recorded_latency(self):
+        self.record()
+        client = harvest.Harvest(self.uri, "tester@example.com", "secret",
+                                 transport=harvest.ReplayTransport(self.path, realtime=True))
+        start = time()
+        client.clients()
+        self.assertTrue(time() - start >= 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
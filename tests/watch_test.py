@@ -0,0 +1,103 @@
+import os, sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest.watch import ADDED, CHANGED, REMOVED
+from stubs import StubTransport
+
+
+class StubClient(object):
+    def __init__(self):
+        self.days = []
+
+    @property
+    def today(self):
+        return {'for_day': '2016-03-01', 'day_entries': self.days.pop(0)}
+
+
+def entry(entry_id, updated_at, **kwargs):
+    kwargs.update({'id': entry_id, 'updated_at': updated_at})
+    return kwargs
+
+
+class TestDailyWatcher(unittest.TestCase):
+    def wait_for(self, predicate):
+        for _ in range(500):
+            if predicate():
+                return
+            time.sleep(0.01)
+        self.fail('timed out')
+
+    def setUp(self):
+        self.client = StubClient()
+        # Long intervals: the background poller only runs once per test
+        self.watcher = harvest.DailyWatcher(self.client, min_interval=3600, max_interval=3600)
+
+    def test_delivers_deltas_only(self):
+        self.client.days = [
+            [entry(1, 't1'), entry(2, 't1')],
+            [entry(1, 't1', hours=0.5), entry(2, 't2'), entry(3, 't2')],
+            [entry(2, 't2'), entry(3, 't2')],
+            [entry(2, 't2'), entry(3, 't2')],
+        ]
+        received = []
+        subscription = self.watcher.subscribe(received.append)
+        # The background poller takes the first day
+        self.wait_for(lambda: len(received) == 2)
+        self.watcher.poll()
+        self.watcher.poll()
+        self.assertEqual([], self.watcher.poll())
+        subscription.cancel()
+        kinds = [(event.kind, event.entry['id']) for event in received]
+        self.assertEqual(sorted([(ADDED, 1), (ADDED, 2)]), sorted(kinds[:2]))
+        self.assertEqual(sorted([(CHANGED, 2), (ADDED, 3)]), sorted(kinds[2:4]))
+        self.assertEqual([(REMOVED, 1)], kinds[4:])
+
+    def test_iterator_and_late_subscriber(self):
+        self.client.days = [[entry(1, 't1')], [entry(1, 't2')]]
+        first = self.watcher.subscribe()
+        event = next(first.events(timeout=5))
+        self.assertEqual((ADDED, 1), (event.kind, event.entry['id']))
+        late = self.watcher.subscribe()
+        self.watcher.poll()
+        first.cancel()
+        late.cancel()
+        self.assertEqual([ADDED, CHANGED], [e.kind for e in late])
+
+    def test_snapshot_precedes_later_changes(self):
+        self.client.days = [[entry(1, 't1'), entry(2, 't1')], [entry(1, 't2'), entry(2, 't2')]]
+        first = self.watcher.subscribe()
+        events = first.events(timeout=5)
+        next(events), next(events)
+        received, pollers = [], []
+
+        def slow(event):
+            received.append(event.kind)
+            if len(received) == 1:
+                # A poll racing with the snapshot must wait for it
+                pollers.append(threading.Thread(target=self.watcher.poll))
+                pollers[0].start()
+                time.sleep(0.1)
+
+        second = self.watcher.subscribe(slow)
+        pollers[0].join(5)
+        first.cancel()
+        second.cancel()
+        self.assertEqual([ADDED, ADDED, CHANGED, CHANGED], received)
+
+    def test_client_shares_one_watcher(self):
+        client = harvest.Harvest("https://example.harvestapp.com", "tester@example.com", "secret",
+                                 transport=StubTransport(default={'for_day': '2016-03-01', 'day_entries': []}))
+        first = client.watch_daily(lambda event: None, min_interval=3600)
+        second = client.watch_daily()
+        self.assertIs(first.watcher, second.watcher)
+        first.cancel()
+        second.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os, sys
+import json
+import shutil
+import tempfile
+import unittest
+from time import sleep
+
+sys.path.insert(0, sys.path[0]+"/..")
+
+import harvest
+from harvest.transport import make_response
+
+
+class StubClient(object):
+    """ Serves /daily requests the way Harvest._request(raw=True) does """
+    def __init__(self):
+        self.calls = []
+        self.attempts = 0
+        self.down = False
+        self.lose_reply = False
+        self.running = set()
+        self.errors = []    # (status, body) replies served before the normal ones
+
+    def _request(self, method='GET', path='/', data=None, priority=None, stream=False, raw=False):
+        self.attempts += 1
+        if self.down:
+            raise harvest.HarvestError('connection refused')
+        if self.errors:
+            return make_response(*self.errors.pop(0))
+        action, entry_id = path.split('/')[2], int(path.split('/')[3])
+        if action == 'update':
+            self.calls.append(('update', entry_id, data))
+        elif action == 'timer':
+            self.calls.append(('toggle', entry_id))
+            self.running ^= set([entry_id])
+            if self.lose_reply:
+                # The toggle went through but the reply did not make it back
+                raise harvest.HarvestError('read timed out')
+        return make_response(200, {'day_entry': {
+            'id': entry_id, 'timer_started_at': '10:00' if entry_id in self.running else None}})
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.tmpdir, 'writes.journal')
+        self.client = StubClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def queue(self):
+        # Long interval: flushes only happen when the test asks for them
+        return harvest.WriteBehindQueue(self.client, self.journal, interval=3600)
+
+    def test_coalesces_updates(self):
+        queue = self.queue()
+        queue.update(1, {'notes': 'a', 'hours': '1.0'})
+        queue.update(1, {'notes': 'ab'})
+        queue.update(2, {'notes': 'x'})
+        queue.toggle_timer(3)
+        queue.toggle_timer(3)
+        self.assertEqual(2, queue.pending)
+        self.assertEqual(2, queue.flush())
+        self.assertEqual([('update', 1, {'notes': 'ab', 'hours': '1.0'}),
+                          ('update', 2, {'notes': 'x'})], self.client.calls)
+        queue.close()
+        self.assertEqual('', open(self.journal).read())
+
+    def test_journal_survives_crash(self):
+        queue = self.queue()
+        queue.update(1, {'notes': 'a'})
+        queue.toggle_timer(1)
+        # Simulate a crash: a new queue recovers the journal before the first one flushed
+        recovered = self.queue()
+        self.assertEqual(2, recovered.pending)
+        recovered.close()
+        queue.close(flush=False)
+        self.assertEqual([('update', 1, {'notes': 'a'}), ('toggle', 1)], self.client.calls)
+
+    def test_toggle_is_not_repeated(self):
+        queue = self.queue()
+        queue.toggle_timer(1)
+        self.client.lose_reply = True
+        self.assertEqual(0, queue.flush())
+        self.client.lose_reply = False
+        # The journal holds the state the toggle leads to, not another toggle
+        with open(self.journal) as handle:
+            self.assertEqual([{'op': 'timer', 'entry_id': 1, 'data': {'running': True}}],
+                             [json.loads(line) for line in handle])
+        self.assertEqual(1, queue.flush())
+        queue.close()
+        self.assertEqual([('toggle', 1)], self.client.calls)
+        self.assertEqual(set([1]), self.client.running)
+
+    def test_crash_after_toggle_sent(self):
+        queue = self.queue()
+        queue.toggle_timer(1)
+        self.client.lose_reply = True
+        queue.flush()
+        self.client.lose_reply = False
+        queue.toggle_timer(1)
+        # Simulate a crash: a new queue recovers the journal
+        recovered = self.queue()
+        recovered.close()
+        queue.close(flush=False)
+        self.assertEqual([('toggle', 1), ('toggle', 1)], self.client.calls)
+        self.assertEqual(set(), self.client.running)
+
+    def test_backs_off_while_api_is_down(self):
+        self.client.down = True
+        queue = harvest.WriteBehindQueue(self.client, self.journal, interval=0.05, max_pending=3)
+        for entry_id in range(3):
+            queue.update(entry_id, {'notes': 'x'})
+        sleep(0.5)
+        queue.close(flush=False)
+        # Flushes at about 0, 0.05, 0.15 and 0.35s
+        self.assertTrue(self.client.attempts <= 6, self.client.attempts)
+        self.assertEqual(3, queue.pending)
+
+    def test_failed_writes_are_retried_in_order(self):
+        queue = self.queue()
+        queue.update(1, {'notes': 'a'})
+        self.client.down = True
+        self.assertEqual(0, queue.flush())
+        queue.update(1, {'hours': '2.0'})
+        self.assertEqual(1, queue.pending)
+        self.client.down = False
+        queue.close()
+        self.assertEqual([('update', 1, {'notes': 'a', 'hours': '2.0'})], self.client.calls)
+
+    def test_server_errors_are_retried(self):
+        queue = self.queue()
+        queue.update(1, {'notes': 'a'})
+        self.client.errors.append((503, {'message': 'Service unavailable'}))
+        self.assertEqual(0, queue.flush())
+        self.assertEqual(503, queue.last_error.status_code)
+        self.assertEqual(1, queue.pending)
+        self.assertEqual(1, queue.flush())
+        queue.close()
+        self.assertEqual([('update', 1, {'notes': 'a'})], self.client.calls)
+        self.assertEqual(0, queue.stats()['dropped'])
+
+    def test_refused_writes_are_dropped(self):
+        queue = self.queue()
+        queue.update(1, {'hours': 'many'})
+        queue.toggle_timer(2)
+        self.client.errors.append((422, {'message': 'Hours is invalid'}))
+        self.client.errors.append((404, {'message': 'Not found'}))
+        queue.flush()
+        self.assertEqual(0, queue.pending)
+        self.assertEqual(2, queue.stats()['dropped'])
+        self.assertEqual(404, queue.last_error.status_code)
+        queue.close()
+        self.assertEqual([], self.client.calls)
+        self.assertEqual(set(), self.client.running)
+
+
+if __name__ == '__main__':
+    unittest.main()